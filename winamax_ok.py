@@ -1,238 +1,2693 @@
+import sys
+from argparse import ArgumentParser
+from asyncio import IncompleteReadError, LimitOverrunError, Queue as AsyncQueue, create_task, gather, \
+    get_running_loop, run as asyncio_run, start_server, start_unix_server
 from cProfile import run as cProfile_run
-from copy import deepcopy as copy_deepcopy
-from random import shuffle as rd_shuffle
-from math import factorial
+from collections import namedtuple, OrderedDict
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from functools import partial
+from hashlib import sha256
+from heapq import heappush, heappop
+from itertools import count
+from json import dumps as json_dumps, loads as json_loads
+from multiprocessing import Pipe, Process, Queue, get_context
+from multiprocessing.connection import wait as wait_connections
+from multiprocessing.resource_tracker import ensure_running as ensure_resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+from multiprocessing.sharedctypes import RawValue
+from os import cpu_count, getpid, register_at_fork, replace as os_replace
+from pickle import HIGHEST_PROTOCOL, dumps as pickle_dumps, loads as pickle_loads
+from queue import Empty
+from random import Random
+from signal import SIGTERM, SIG_DFL, signal
+from sqlite3 import connect as sqlite_connect
+from time import perf_counter, time
 
 
-def finalize_golf_course(golf_course):
+# cell codes of the flat grid (balls are stored as BALL + their shot count)
+EMPTY, WATER, HOLE, BALL_IN_HOLE, BORDER, UP, RIGHT, DOWN, LEFT, BALL = range(10)
+ARROW_CODES = {"^": UP, ">": RIGHT, "v": DOWN, "<": LEFT}
+REVERSE_ARROW = {UP: DOWN, DOWN: UP, LEFT: RIGHT, RIGHT: LEFT}
+CHAR_CODES = {".": EMPTY, "X": WATER, "H": HOLE, "BinH": BALL_IN_HOLE, **ARROW_CODES}
+# rendering table for bytes.translate ("X" and "BinH" are rendered as ".")
+RENDER_TABLE = bytearray(range(256))
+RENDER_TABLE[EMPTY:BALL] = b"..H.#^>v<"
+RENDER_TABLE[BALL:BALL + 10] = b"0123456789"
+RENDER_TABLE = bytes(RENDER_TABLE)
+DIRECTIONS_STRATEGY = ("^", ">", "v", "<")
+# cells of a golf course in CodinGame format (empty, water, hole and the shot counts of the balls)
+GOLF_COURSE_CHARS = frozenset(".XH123456789")
+ARROW_VECTORS = {UP: (-1, 0), RIGHT: (0, 1), DOWN: (1, 0), LEFT: (0, -1)}
+VECTOR_ARROWS = {vector: arrow for arrow, vector in ARROW_VECTORS.items()}
+# the 8 rotations / reflections as matrices (a, b, c, d): (row, col) -> (a * row + b * col, c * row + d * col)
+SYMMETRIES = ((1, 0, 0, 1), (0, 1, -1, 0), (-1, 0, 0, -1), (0, -1, 1, 0),
+              (-1, 0, 0, 1), (1, 0, 0, -1), (0, 1, 1, 0), (0, -1, -1, 0))
+
+# a path of a ball to a hole: start index, hole index, bitmask of the flat indices it uses (hole included) and the
+# arrow code of each of its shots
+CandidatePath = namedtuple("CandidatePath", ["ball", "hole", "mask", "directions"])
+# every candidate path of a golf course numbered: the bitset of path ids of each ball, for each path id the bitset of
+# the path ids conflicting with it, the bitset of path ids ending in each reachable hole and, for each ball, the list of
+# (hole number, bitset of its path ids ending in this hole)
+PathsTable = namedtuple("PathsTable", ["paths", "domains", "conflicts", "holes", "ball_holes"])
+# every shot of the static golf course: transitions[((start << 2) | (direction - UP)) * (max_distance + 1) + distance]
+# (the cells drawn by a shot are its shape shifted to its lowest index, so the table grows with the cells only), the
+# bit of each hole index for the reachability oracle and the memo of reachable_holes
+ShotTable = namedtuple("ShotTable", ["max_distance", "transitions", "hole_bits", "reachable"])
+# maximum number of nogoods kept by the search
+NOGOODS_LIMIT = 10000
+# number of nodes of the first run of restart_search (the next runs follow the Luby sequence) and number of runs
+# before the search goes on without budget
+RESTART_NODES = 100
+RESTARTS_LIMIT = 30
+# maximum number of ball-to-hole assignments tried one by one by murty_region
+MURTY_LIMIT = 100
+# maximum number of shot table entries (see build_shot_table) of the templates kept by TemplateCache (a few hundred MB
+# at most)
+TEMPLATES_CACHE_SIZE = 1 << 21
+# smallest region searched by a pool of processes in parallel_region, and number of sub-trees given to each worker
+PARALLEL_MIN_BALLS = 8
+SUBTREES_PER_WORKER = 4
+# number of nodes searched by a worker between two looks at the stop flag
+CANCEL_CHECK_NODES = 100
+# a chunk of solve_golf_courses_pool is closed at this estimated difficulty (see estimate_difficulty) or size
+BATCH_CHUNK_DIFFICULTY = 2000
+BATCH_CHUNK_SIZE = 64
+# default port of SolveServer, maximum number of golf courses waiting for its workers and maximum length in bytes of
+# a request line (a 2000 x 2000 golf course)
+SERVER_PORT = 8765
+SERVER_QUEUE_SIZE = 256
+SERVER_LINE_LIMIT = 1 << 22
+# searches raced by portfolio_golf_course: (solver mode, directions strategy, balls order)
+PORTFOLIO = (("backtrack", ("^", ">", "v", "<"), "given"), ("dlx", ("v", "<", "^", ">"), "reversed"),
+             ("murty", (">", "v", "<", "^"), "farthest"), ("backtrack", ("<", "^", ">", "v"), "nearest"))
+# seconds between two looks of portfolio_golf_course at its searches still alive while it waits for an answer
+PORTFOLIO_POLL_TIME = 0.1
+
+
+class GolfGrid:
+    """
+    Golf course stored in one padded bytearray: every cell is a small integer code and the course is surrounded by
+    a BORDER sentinel, so a shot leaving the course fails on the border instead of needing bounds checks.
+    Cells are addressed by their flat index, moving is index arithmetic (+-1, +-stride).
+    """
+    __slots__ = ("width", "height", "stride", "cells", "steps")
+
+    def __init__(self, golf_course):
+        """
+        :param golf_course: golf course as a list of rows (each row a list of cells or a string)
+        """
+        self.height = len(golf_course)
+        self.width = len(golf_course[0])
+        self.stride = self.width + 2
+        self.cells = bytearray([BORDER]) * (self.stride * (self.height + 2))
+        self.steps = {UP: -self.stride, DOWN: self.stride, LEFT: -1, RIGHT: 1}
+        for row_index, row in enumerate(golf_course):
+            start = self.index(row_index, 0)
+            self.cells[start:start + self.width] = bytes(
+                BALL + int(elt) if elt.isdigit() else CHAR_CODES[elt] for elt in row)
+
+    def index(self, row, col):
+        """
+        :param row: row of the cell on the course
+        :param col: column of the cell on the course
+        :return: flat index of the cell in the padded buffer
+        """
+        return (row + 1) * self.stride + col + 1
+
+    def coord(self, index):
+        """
+        :param index: flat index of the cell in the padded buffer
+        :return: (row, col) coordinates of the cell on the course
+        """
+        return index // self.stride - 1, index % self.stride - 1
+
+    def copy(self):
+        """
+        :return: new GolfGrid with a copy of the cells
+        """
+        grid = GolfGrid.__new__(GolfGrid)
+        grid.width = self.width
+        grid.height = self.height
+        grid.stride = self.stride
+        grid.cells = bytearray(self.cells)
+        grid.steps = self.steps
+        return grid
+
+
+def finalize_golf_course(grid):
     """
-    :param golf_course: final golf course to clean
+    :param grid: final golf course to clean (GolfGrid)
     :return: cleaned golf_course (without "BinH" and "X")
     """
-    matrix_to_list = []
-    for row in golf_course:
-        for elt in row:
-            if elt in {"X", "BinH"}:
-                matrix_to_list.append(".")
-            else:
-                matrix_to_list.append(elt)
-        matrix_to_list.append('\n')
+    rows = []
+    for row_index in range(grid.height):
+        start = grid.index(row_index, 0)
+        rows.append(grid.cells[start:start + grid.width].translate(RENDER_TABLE))
+        rows.append(b"\n")
 
-    return ''.join(matrix_to_list)
+    return b"".join(rows).decode("ascii")
 
 
-def get_ball_directions(golf_course, ball, distance, directions_strategy, water_just_crossed, previous_direction):
+def get_ball_directions(directions_strategy, water_just_crossed, previous_direction):
     """
-    :param golf_course: current state of golf course
-    :param ball: current ball coordinates
-    :param distance: distance the ball must respect on this shot
-    :param directions_strategy: the order of the directions to respect
+    :param directions_strategy: the order of the directions to respect (arrow codes)
     :param water_just_crossed: True if the ball just crossed water
-    :param previous_direction: direction that ball just followed
+    :param previous_direction: direction that ball just followed (arrow code)
     :return: list of possible directions that ball will follow (avoid reverse direction)
     """
-    dict_reverse_direction = {"v": "^", "^": "v", "<": ">", ">": "<"}
-    ball_directions = []
-
-    height = len(golf_course) - 1
-    width = len(golf_course[0]) - 1
-
     # if ball just crossed water, it must follow the same direction as previously
     if water_just_crossed:
-        if previous_direction == "v":
-            if height - ball[0] >= distance:
-                ball_directions.append(previous_direction)
-        elif previous_direction == "^":
-            if ball[0] >= distance:
-                ball_directions.append(previous_direction)
-        elif previous_direction == ">":
-            if width - ball[1] >= distance:
-                ball_directions.append(previous_direction)
-        elif previous_direction == "<":
-            if ball[1] >= distance:
-                ball_directions.append(previous_direction)
-    else:
-        for direction in directions_strategy:
-            if direction == "^":
-                if ball[0] >= distance:
-                    ball_directions.append("^")
-            elif direction == ">":
-                if width - ball[1] >= distance:
-                    ball_directions.append(">")
-            elif direction == "v":
-                if height - ball[0] >= distance:
-                    ball_directions.append("v")
-            elif direction == "<":
-                if ball[1] >= distance:
-                    ball_directions.append("<")
-
-    # Remove the reverse direction if it was selected
-    if previous_direction and not water_just_crossed:
-        if dict_reverse_direction[previous_direction] in ball_directions:
-            ball_directions.remove(dict_reverse_direction[previous_direction])
-
-    return ball_directions
-
-
-def get_next_coord(ball, direction):
-    """
-    :param ball: current ball coordinates
-    :param direction: direction that ball follows
-    :return: ball coordinates after having passed the direction
-    """
-    if direction == "^":
-        return ball[0] - 1, ball[1]
-    elif direction == "v":
-        return ball[0] + 1, ball[1]
-    elif direction == "<":
-        return ball[0], ball[1] - 1
-    elif direction == ">":
-        return ball[0], ball[1] + 1
-
-
-def update_golf_course(golf_course, ball, distance, direction):
-    """
-    :param golf_course: current state of golf course
-    :param ball: current ball coordinates
-    :param distance: distance the ball must respect on this shot
-    :param direction: direction that ball follows
-    :return: golf course updated with current ball path drawn
-    """
-    # initialization of variables:
-    water_just_crossed = False
-    # need to copy the list because of backtracking (to be able to go back to the previous state of golf course)
-    golf_course_to_update = copy_deepcopy(golf_course)
-
-    # start ball
-    golf_course_to_update[ball[0]][ball[1]] = direction
-    ball = get_next_coord((ball[0], ball[1]), direction)
-
-    # draws the path for the ball
-    for i in range(1, distance):
-        if golf_course_to_update[ball[0]][ball[1]] in {".", "X"}:
-            golf_course_to_update[ball[0]][ball[1]] = direction
-            ball = get_next_coord(ball, direction)
-        # the ball passes through another hole or path: fail
+        return [previous_direction]
+    # Remove the reverse direction (the shots leaving the course fail on the border)
+    if previous_direction:
+        return [direction for direction in directions_strategy if direction != REVERSE_ARROW[previous_direction]]
+    return directions_strategy
+
+
+def build_shot_table(grid, max_distance):
+    """
+    :param grid: static golf course (start status)
+    :param max_distance: biggest shot count of the balls
+    :return: ShotTable giving, for every (start cell, distance, direction), the shot against the static terrain:
+             None if it passes over a hole, a ball or the border or lands on a ball or the border, else
+             (landing index, landing cell code, shape, lowest index): shape << lowest index is the bitmask of the cells
+             drawn by the shot (start included, landing excluded)
+    """
+    cells = grid.cells
+    width = max_distance + 1
+    # bitmask of the cells drawn by a shot of each direction and distance, from its lowest cell (shared by every shot)
+    shapes = [0] * (4 * width)
+    for direction in (UP, RIGHT, DOWN, LEFT):
+        step = abs(grid.steps[direction])
+        for distance in range(1, width):
+            shape_index = (direction - UP) * width + distance
+            shapes[shape_index] = shapes[shape_index - 1] | 1 << (distance - 1) * step
+    transitions = [None] * (len(cells) * 4 * width)
+    for start, code in enumerate(cells):
+        # a shot starts from a ball or from where the previous shot landed
+        if code > WATER and code < BALL:
+            continue
+        for direction in (UP, RIGHT, DOWN, LEFT):
+            step = grid.steps[direction]
+            index = ((start << 2) | (direction - UP)) * width
+            landing = start
+            for distance in range(1, width):
+                landing += step
+                landing_code = cells[landing]
+                if landing_code <= HOLE:
+                    transitions[index + distance] = (landing, landing_code, shapes[(direction - UP) * width + distance],
+                                                     start if step > 0 else landing - step)
+                # the next shots would pass over this cell (the border always stops the loop)
+                if landing_code > WATER:
+                    break
+
+    # holes numbered for the reachability oracle (small bitmasks)
+    hole_bits = {}
+    for cell, code in enumerate(cells):
+        if code == HOLE:
+            hole_bits[cell] = 1 << len(hole_bits)
+
+    return ShotTable(max_distance, transitions, hole_bits, {})
+
+
+def reachable_holes(shot_table, cell, distance, forced_direction=0):
+    """
+    Reachability oracle on the static golf course (the ball's own path is ignored, so it may only over-estimate),
+    memoised in the shot table: each state is computed once for all the balls and searches on the golf course.
+    :param shot_table: ShotTable of the golf course
+    :param cell: current ball index
+    :param distance: shot count left to the ball
+    :param forced_direction: direction the ball must follow after landing on water (0 if free)
+    :return: bitmask of the numbers of the holes (see ShotTable.hole_bits) the ball can possibly reach from this state
+    """
+    reachable = shot_table.reachable
+    width = shot_table.max_distance + 1
+    key = ((cell * width + distance) << 4) | forced_direction
+    holes = reachable.get(key)
+    if holes is None:
+        holes = 0
+        transitions = shot_table.transitions
+        for direction in (forced_direction,) if forced_direction else (UP, RIGHT, DOWN, LEFT):
+            transition = transitions[((cell << 2) | (direction - UP)) * width + distance]
+            if transition is None:
+                continue
+            landing, landing_code = transition[0], transition[1]
+            if landing_code == HOLE:
+                holes |= shot_table.hole_bits[landing]
+            elif distance > 1:
+                next_direction = direction if landing_code == WATER else 0
+                next_holes = reachable.get(((landing * width + distance - 1) << 4) | next_direction)
+                if next_holes is None:
+                    next_holes = reachable_holes(shot_table, landing, distance - 1, next_direction)
+                holes |= next_holes
+        reachable[key] = holes
+    return holes
+
+
+def backtrack(shot_table, ball, distance, directions_strategy, paths, free_holes=-1, blocked=0):
+    """
+    Enumerate the paths of a ball depth first on an explicit stack of frames (one per shot being played), so the
+    enumeration does not depend on the Python stack
+    :param shot_table: ShotTable of the golf course
+    :param ball: index of the ball whose paths are enumerated
+    :param distance: shot count of the ball
+    :param directions_strategy: the order of the directions to respect (arrow codes)
+    :param paths: list where every path reaching a hole is appended as a CandidatePath
+    :param free_holes: bitmask of the numbers of the holes the ball may target (all of them by default)
+    :param blocked: bitmask of the cells the ball may not cross nor land on (other balls missing from the shot table)
+    """
+    transitions = shot_table.transitions
+    hole_bits = shot_table.hole_bits
+    width = shot_table.max_distance + 1
+    # directions of the shots leading to the frame on top of the stack
+    shots = []
+    # frames (cell, distance left, bitmask of the cells already drawn, iterator on the directions left to try)
+    stack = [(ball, distance, blocked, iter(directions_strategy))]
+    while stack:
+        cell, distance, occupied, directions = stack[-1]
+        for direction in directions:
+            transition = transitions[((cell << 2) | (direction - UP)) * width + distance]
+            # the shot is not legal on the static golf course
+            if transition is None:
+                continue
+            landing, landing_code, shape, lowest = transition
+            mask = shape << lowest
+            landing_bit = 1 << landing
+            # the ball crosses or lands on its own path
+            if (mask | landing_bit) & occupied:
+                continue
+            # case ball is in the hole: success, the path is recorded (hole cell included in its mask)
+            if landing_code == HOLE:
+                if hole_bits[landing] & free_holes:
+                    shots.append(direction)
+                    paths.append(CandidatePath(ball, landing, (occupied | mask | landing_bit) & ~blocked,
+                                               bytes(shots)))
+                    shots.pop()
+            # go further in the different paths the ball can still follow (if it still has shots and a free hole is
+            # still reachable from there): the new frame is searched before the next direction of this one
+            elif distance > 1 and reachable_holes(shot_table, landing, distance - 1,
+                                                  direction if landing_code == WATER else 0) & free_holes:
+                shots.append(direction)
+                stack.append((landing, distance - 1, occupied | mask,
+                              iter(get_ball_directions(directions_strategy, landing_code == WATER, direction))))
+                break
         else:
-            return False, None, None, None
+            # every direction of this frame has been tried: back to the shot before
+            stack.pop()
+            if shots:
+                shots.pop()
 
-    # checks where the ball just landed
-    if golf_course_to_update[ball[0]][ball[1]] == "X":
-        water_just_crossed = True
-    # the ball lands on a hole already targeted or a path: fail
-    elif golf_course_to_update[ball[0]][ball[1]] not in {".", "H"}:
-        return False, None, None, None
 
-    return True, water_just_crossed, golf_course_to_update, ball
+def get_candidate_paths(grid, ball, distance, directions_strategy=DIRECTIONS_STRATEGY, shot_table=None,
+                        free_holes=-1, blocked=0):
+    """
+    :param grid: static golf course (start status)
+    :param ball: ball coordinates
+    :param distance: shot count of the ball
+    :param directions_strategy: the order of the directions to respect
+    :param shot_table: ShotTable of the golf course (built for this ball if None)
+    :param free_holes: bitmask of the numbers of the holes the ball may target (all of them by default)
+    :param blocked: bitmask of the cells the ball may not cross nor land on (other balls missing from the shot table)
+    :return: list of every path of the ball reaching a hole under the static rules, in directions strategy order
+    """
+    if shot_table is None:
+        shot_table = build_shot_table(grid, distance)
+    paths = []
+    ball = grid.index(*ball)
+    if reachable_holes(shot_table, ball, distance) & free_holes:
+        backtrack(shot_table, ball, distance, [ARROW_CODES[direction] for direction in directions_strategy], paths,
+                  free_holes, blocked)
+    return paths
 
 
-def backtrack(golf_course, ball, distance, directions_strategy, water_just_crossed=False, previous_direction=None):
+def get_balls_candidate_paths(grid, balls_distances, directions_strategy=DIRECTIONS_STRATEGY, shot_table=None):
     """
-    :param golf_course: current state of golf course
-    :param ball: current ball coordinates
-    :param distance: distance the ball must respect on this shot
+    :param grid: static golf course (start status)
+    :param balls_distances: list of the balls/distances to analyse
     :param directions_strategy: the order of the directions to respect
-    :param water_just_crossed: True if the ball just crossed water
-    :param previous_direction: direction ball just followed
-    :return: either the updated golf course if last direction the ball followed is a success, or None if it's a fail
-    """
-    # case ball is in the hole: success
-    if golf_course[ball[0]][ball[1]] == "H":
-        golf_course[ball[0]][ball[1]] = "BinH"  # BinH to warn the future path that this hole has been targeted
-        return True, golf_course
-    # case distance left is 0 and ball did not reach the hole: fail
-    elif distance == 0:
-        return False, None
+    :param shot_table: ShotTable of the golf course (built once for all the balls if None, it may also be the
+                       ShotTable of the terrain alone: the balls block each other's paths anyway)
+    :return: dict ball coordinates -> list of its candidate paths
+    """
+    if shot_table is None:
+        shot_table = build_shot_table(grid, max((distance for _, distance in balls_distances), default=0))
+    balls_mask = 0
+    for ball, _ in balls_distances:
+        balls_mask |= 1 << grid.index(*ball)
+    return {ball: get_candidate_paths(grid, ball, distance, directions_strategy, shot_table, -1,
+                                      balls_mask & ~(1 << grid.index(*ball)))
+            for ball, distance in balls_distances}
+
+
+def draw_path(grid, path):
+    """
+    :param grid: golf course (updated in place)
+    :param path: CandidatePath to draw, its ball must still be on the golf course
+    """
+    cells = grid.cells
+    ball = path.ball
+    distance = cells[ball] - BALL
+    for direction in path.directions:
+        step = grid.steps[direction]
+        for i in range(distance):
+            cells[ball] = direction
+            ball += step
+        distance -= 1
+    cells[path.hole] = BALL_IN_HOLE
+
+
+def iter_bits(bitset):
+    """
+    :param bitset: python int used as a bitset
+    :return: generator of the indices of the bits set, lowest first
+    """
+    while bitset:
+        low_bit = bitset & -bitset
+        yield low_bit.bit_length() - 1
+        bitset ^= low_bit
+
+
+def build_paths_table(balls_candidate_paths):
+    """
+    :param balls_candidate_paths: list of the candidate paths of each ball
+    :return: PathsTable with every path numbered, the bitset of path ids of each ball, for each path the bitset of
+             the paths it rules out (sharing a cell or a hole with it, the other paths of its ball included), the
+             paths ending in each hole and the holes each ball can reach
+    """
+    paths = []
+    domains = []
+    # bitset of the paths using each cell / ending in each hole
+    cell_paths = {}
+    hole_paths = {}
+    for ball_paths in balls_candidate_paths:
+        domain = 0
+        for path in ball_paths:
+            path_bit = 1 << len(paths)
+            paths.append(path)
+            domain |= path_bit
+            hole_paths[path.hole] = hole_paths.get(path.hole, 0) | path_bit
+            for cell in iter_bits(path.mask):
+                cell_paths[cell] = cell_paths.get(cell, 0) | path_bit
+        domains.append(domain)
+
+    conflicts = []
+    for path in paths:
+        path_conflicts = 0
+        for cell in iter_bits(path.mask):
+            path_conflicts |= cell_paths[cell]
+        conflicts.append(path_conflicts)
+
+    holes = list(hole_paths.values())
+    ball_holes = [[(hole, paths_to_hole & domain) for hole, paths_to_hole in enumerate(holes) if paths_to_hole & domain]
+                  for domain in domains]
+
+    return PathsTable(paths, domains, conflicts, holes, ball_holes)
+
+
+def explain_ball(table, ball, chosen, reasons, extra_reasons):
+    """
+    :param table: PathsTable of the golf course
+    :param ball: ball not placed yet
+    :param chosen: bitset of the path ids already chosen
+    :param reasons: dict chosen path id -> bitset of the decisions (path ids) it depends on
+    :param extra_reasons: dict ball -> bitset of the decisions that removed its paths through the holes rule
+    :return: bitset of the decisions responsible for the paths of the ball that are not compatible any more
+    """
+    domain = table.domains[ball]
+    culprits = extra_reasons.get(ball, 0)
+    for path_id in iter_bits(chosen):
+        if table.conflicts[path_id] & domain:
+            culprits |= reasons[path_id]
+    return culprits
+
+
+def explain_hole(table, hole_paths, chosen, unplaced, reasons, extra_reasons):
+    """
+    :param table: PathsTable of the golf course
+    :param hole_paths: bitset of the paths ending in the hole
+    :param chosen: bitset of the path ids already chosen
+    :param unplaced: list of the balls not placed yet
+    :param reasons: dict chosen path id -> bitset of the decisions (path ids) it depends on
+    :param extra_reasons: dict ball -> bitset of the decisions that removed its paths through the holes rule
+    :return: bitset of the decisions responsible for the paths ending in the hole that are not compatible any more
+    """
+    culprits = 0
+    for path_id in iter_bits(chosen):
+        if table.conflicts[path_id] & hole_paths:
+            culprits |= reasons[path_id]
+    for ball in unplaced:
+        if table.domains[ball] & hole_paths:
+            culprits |= extra_reasons.get(ball, 0)
+    return culprits
+
+
+def propagate(table, allowed, chosen, unplaced, reasons, extra_reasons):
+    """
+    Forward checking after a path has been chosen: the balls left without any compatible path make the branch fail,
+    the balls left with a single path and, when every reachable hole must receive a ball, the only ball still able to
+    reach a hole are placed at once (until nothing changes). Every forced choice keeps the decisions it depends on.
+    :param table: PathsTable of the golf course
+    :param allowed: bitset of the paths compatible with the paths already chosen
+    :param chosen: bitset of the path ids already chosen
+    :param unplaced: list of the balls not placed yet
+    :param reasons: dict chosen path id -> bitset of the decisions (path ids) it depends on
+    :param extra_reasons: dict ball -> bitset of the decisions that removed its paths through the holes rule
+    :return: ((allowed, chosen, unplaced, reasons, extra_reasons) after propagation, 0) or (None, bitset of the
+             decisions responsible) if a ball or a hole is left without any path
+    """
+    domains = table.domains
+    conflicts = table.conflicts
+    every_hole_used = len(table.holes) == len(domains)
+    reasons = dict(reasons)
+    extra_reasons = dict(extra_reasons)
+    changed = True
+    while changed:
+        changed = False
+        remaining = []
+        for ball in unplaced:
+            domain = domains[ball] & allowed
+            if not domain:
+                return None, explain_ball(table, ball, chosen, reasons, extra_reasons)
+            # single path left: forced
+            if not domain & (domain - 1):
+                path_id = domain.bit_length() - 1
+                reasons[path_id] = explain_ball(table, ball, chosen, reasons, extra_reasons)
+                chosen |= domain
+                allowed &= ~conflicts[path_id]
+                changed = True
+            else:
+                remaining.append(ball)
+        unplaced = remaining
+
+        if every_hole_used:
+            for hole_paths in table.holes:
+                if hole_paths & chosen:
+                    continue
+                live_paths = hole_paths & allowed
+                if not live_paths:
+                    return None, explain_hole(table, hole_paths, chosen, unplaced, reasons, extra_reasons)
+                hole_balls = [ball for ball in unplaced if domains[ball] & live_paths]
+                # hole reachable by a single ball: this ball must go in this hole
+                if len(hole_balls) == 1 and domains[hole_balls[0]] & allowed & ~hole_paths:
+                    ball = hole_balls[0]
+                    extra_reasons[ball] = extra_reasons.get(ball, 0) | explain_hole(table, hole_paths, chosen,
+                                                                                    unplaced, reasons,
+                                                                                    extra_reasons)
+                    allowed &= ~(domains[ball] & ~hole_paths)
+                    changed = True
+
+    return (allowed, chosen, unplaced, reasons, extra_reasons), 0
+
+
+def hopcroft_karp(adjacency, nb_holes):
+    """
+    :param adjacency: list of the hole numbers each ball can still reach
+    :param nb_holes: number of holes
+    :return: list of the hole matched to each ball (-1 if unmatched) in a maximum matching
+    """
+    ball_match = [-1] * len(adjacency)
+    hole_match = [-1] * nb_holes
+    infinity = len(adjacency) + 1
+    while True:
+        # breadth first search: layers of the alternating paths starting from the free balls
+        layers = [0 if match == -1 else infinity for match in ball_match]
+        queue = [ball for ball, match in enumerate(ball_match) if match == -1]
+        found = False
+        for ball in queue:
+            for hole in adjacency[ball]:
+                other = hole_match[hole]
+                if other == -1:
+                    found = True
+                elif layers[other] == infinity:
+                    layers[other] = layers[ball] + 1
+                    queue.append(other)
+        if not found:
+            return ball_match
+
+        # depth first search: vertex-disjoint shortest augmenting paths along the layers, on an explicit stack of
+        # frames (ball, iterator on the holes left to try) with the hole leading from each frame to the next one
+        for free_ball in range(len(adjacency)):
+            if ball_match[free_ball] != -1:
+                continue
+            stack = [(free_ball, iter(adjacency[free_ball]))]
+            holes = []
+            while stack:
+                ball, ball_holes = stack[-1]
+                for hole in ball_holes:
+                    other = hole_match[hole]
+                    if other == -1:
+                        # augmenting path found: every ball of the stack takes the hole after it
+                        holes.append(hole)
+                        for (path_ball, _), path_hole in zip(stack, holes):
+                            ball_match[path_ball] = path_hole
+                            hole_match[path_hole] = path_ball
+                        stack.clear()
+                        break
+                    if layers[other] == layers[ball] + 1:
+                        holes.append(hole)
+                        stack.append((other, iter(adjacency[other])))
+                        break
+                else:
+                    # no augmenting path through this ball: dropped from the layers
+                    layers[ball] = infinity
+                    stack.pop()
+                    if holes:
+                        holes.pop()
+
+
+def check_matching(table, allowed, unplaced):
+    """
+    :param table: PathsTable of the golf course
+    :param allowed: bitset of the paths compatible with the paths already chosen
+    :param unplaced: list of the balls not placed yet
+    :return: None if every unplaced ball can still get its own free hole, else a set of balls reaching fewer holes
+             than there are balls in it (Hall's theorem)
+    """
+    adjacency = [[hole for hole, paths_to_hole in table.ball_holes[ball] if paths_to_hole & allowed]
+                 for ball in unplaced]
+    ball_match = hopcroft_karp(adjacency, len(table.holes))
+    if -1 not in ball_match:
+        return None
+
+    # the balls reachable from an unmatched ball by alternating paths reach fewer holes than their number
+    hole_match = {hole: ball for ball, hole in enumerate(ball_match) if hole != -1}
+    violators = [ball_match.index(-1)]
+    seen = set(violators)
+    for ball in violators:
+        for hole in adjacency[ball]:
+            other = hole_match.get(hole)
+            if other is not None and other not in seen:
+                seen.add(other)
+                violators.append(other)
+    return [unplaced[ball] for ball in violators]
+
+
+def choose_ball(table, allowed, unplaced, rng=None):
+    """
+    :param table: PathsTable of the golf course
+    :param allowed: bitset of the paths compatible with the paths already chosen
+    :param unplaced: list of the balls not placed yet
+    :param rng: Random breaking the remaining ties (None to keep the first ball)
+    :return: the most constrained ball (fewest compatible paths, ties broken by the number of paths of the other
+             balls its paths rule out)
+    """
+    domains = table.domains
+    sizes = [(domains[ball] & allowed).bit_count() for ball in unplaced]
+    smallest = min(sizes)
+    tied_balls = [ball for ball, size in zip(unplaced, sizes) if size == smallest]
+    if len(tied_balls) == 1:
+        return tied_balls[0]
+
+    def degree(ball):
+        ruled_out = 0
+        for path_id in iter_bits(domains[ball] & allowed):
+            ruled_out |= table.conflicts[path_id]
+        return (ruled_out & allowed & ~domains[ball]).bit_count()
+
+    if rng is None:
+        return max(tied_balls, key=degree)
+    degrees = [degree(ball) for ball in tied_balls]
+    largest = max(degrees)
+    return rng.choice([ball for ball, ball_degree in zip(tied_balls, degrees) if ball_degree == largest])
+
+
+def order_paths(table, allowed, ball, rng=None):
+    """
+    :param table: PathsTable of the golf course
+    :param allowed: bitset of the paths compatible with the paths already chosen
+    :param ball: ball to place
+    :param rng: Random breaking the ties (None to keep them in directions strategy order)
+    :return: compatible path ids of the ball, least constraining first (fewest paths of the other balls ruled out,
+             ties kept in directions strategy order)
+    """
+    others_allowed = allowed & ~table.domains[ball]
+    if rng is None:
+        return sorted(iter_bits(table.domains[ball] & allowed),
+                      key=lambda path_id: (table.conflicts[path_id] & others_allowed).bit_count())
+    return sorted(iter_bits(table.domains[ball] & allowed),
+                  key=lambda path_id: ((table.conflicts[path_id] & others_allowed).bit_count(), rng.random()))
+
+
+class NogoodStore:
+    """
+    Nogoods learned by BackjumpSearch (bitsets of path ids that cannot be chosen together), indexed by each of their
+    path ids: a node only looks at the nogoods of the paths it has just chosen (a nogood whose paths were all chosen
+    before has already cut the branch), and a duplicate is found with a set instead of a scan
+    """
+    __slots__ = ("maxsize", "by_path", "seen")
+
+    def __init__(self, maxsize=NOGOODS_LIMIT):
+        """
+        :param maxsize: maximum number of nogoods kept (the next ones are dropped)
+        """
+        self.maxsize = maxsize
+        # path id -> list of the nogoods containing it
+        self.by_path = {}
+        self.seen = set()
+
+    def __len__(self):
+        return len(self.seen)
+
+    def add(self, nogood):
+        """
+        :param nogood: bitset of path ids that cannot be chosen together
+        """
+        if len(self.seen) < self.maxsize and nogood not in self.seen:
+            self.seen.add(nogood)
+            for path_id in iter_bits(nogood):
+                self.by_path.setdefault(path_id, []).append(nogood)
+
+    def find(self, chosen, new):
+        """
+        :param chosen: bitset of the path ids chosen
+        :param new: bitset of the path ids of chosen not looked at yet (by the node above)
+        :return: a nogood made of chosen paths only and containing a new one, 0 if the empty nogood is known (there is
+                 no solution at all) or None if there is none
+        """
+        if 0 in self.seen:
+            return 0
+        by_path = self.by_path
+        for path_id in iter_bits(new):
+            for nogood in by_path.get(path_id, ()):
+                if nogood & chosen == nogood:
+                    return nogood
+        return None
+
+
+class BackjumpSearch:
+    """
+    Search with conflict-directed backjumping: every failure returns the decisions responsible for it, a decision
+    that is not one of them is skipped (its other paths would fail the same way) and the decisions responsible for
+    the failure of a whole ball are recorded as a nogood.
+    The search runs on an explicit stack of frames (one per ball chosen by the search), so its depth does not depend on
+    the Python stack, and it can be paused after a number of nodes and resumed later.
+    """
+    __slots__ = ("table", "nogoods", "rng", "stack", "node", "result", "nodes", "solution", "finished")
+
+    def __init__(self, table, nogoods=None, allowed=-1, rng=None):
+        """
+        :param table: PathsTable of the golf course
+        :param nogoods: NogoodStore kept from a previous search on the same table (and the same allowed paths) and
+                        completed by this one (None for a new one)
+        :param allowed: bitset of the paths the search may choose (all of them by default)
+        :param rng: Random breaking the ties of choose_ball and order_paths (None to keep them in order)
+        """
+        self.table = table
+        self.nogoods = NogoodStore() if nogoods is None else nogoods
+        self.rng = rng
+        # frames [allowed, chosen, other balls, reasons, extra_reasons, path ids of the ball, next position, culprits]
+        self.stack = []
+        # node to enter: (allowed, chosen, unplaced, reasons, extra_reasons, chosen paths already checked)
+        self.node = (allowed, 0, list(range(len(table.domains))), {}, {}, 0)
+        # (solution, culprits) of the last node left, to hand to the frame below
+        self.result = None
+        self.nodes = 0
+        self.solution = None
+        self.finished = False
+
+    def enter(self, allowed, chosen, unplaced, reasons, extra_reasons, checked):
+        """
+        :param allowed: bitset of the paths compatible with the paths already chosen
+        :param chosen: bitset of the path ids already chosen
+        :param unplaced: list of the balls not placed yet
+        :param reasons: dict chosen path id -> bitset of the decisions (path ids) it depends on
+        :param extra_reasons: dict ball -> bitset of the decisions that removed its paths through the holes rule
+        :param checked: bitset of the chosen path ids whose nogoods were looked at by the node above
+        :return: (list of the chosen path ids, 0) or (None, bitset of the decisions responsible for the failure) if the
+                 node is settled at once, None once the frame of its next ball is pushed
+        """
+        table = self.table
+        state, culprits = propagate(table, allowed, chosen, unplaced, reasons, extra_reasons)
+        if state is None:
+            return None, culprits
+        allowed, chosen, unplaced, reasons, extra_reasons = state
+        nogood = self.nogoods.find(chosen, chosen & ~checked)
+        if nogood is not None:
+            for path_id in iter_bits(nogood):
+                culprits |= reasons[path_id]
+            return None, culprits
+        if not unplaced:
+            return list(iter_bits(chosen)), 0
+        # the remaining balls must be matched to distinct free holes: the balls of a Hall violator make the branch fail
+        violators = check_matching(table, allowed, unplaced)
+        if violators is not None:
+            for ball in violators:
+                culprits |= explain_ball(table, ball, chosen, reasons, extra_reasons)
+            return None, culprits
+
+        ball = choose_ball(table, allowed, unplaced, self.rng)
+        others = [other for other in unplaced if other != ball]
+        # the paths of the ball already ruled out are part of the failure if every other path fails
+        culprits = explain_ball(table, ball, chosen, reasons, extra_reasons)
+        self.stack.append([allowed, chosen, others, reasons, extra_reasons, order_paths(table, allowed, ball, self.rng),
+                           0, culprits])
+        return None
+
+    def run(self, max_nodes=None):
+        """
+        :param max_nodes: number of nodes to visit before pausing (None to search until the end)
+        :return: True once the search is over (solution in self.solution, None if there is none), False if paused
+        """
+        if self.finished:
+            return True
+        conflicts = self.table.conflicts
+        nogoods = self.nogoods
+        stack = self.stack
+        node = self.node
+        result = self.result
+        visited = 0
+        while True:
+            if node is not None:
+                if visited == max_nodes:
+                    self.node = node
+                    self.result = result
+                    self.nodes += visited
+                    return False
+                visited += 1
+                result = self.enter(*node)
+                node = None
+
+            if result is not None:
+                solution, conflict = result
+                if solution is not None or not stack:
+                    self.solution = solution
+                    self.finished = True
+                    self.node = self.result = None
+                    self.nodes += visited
+                    stack.clear()
+                    return True
+                frame = stack[-1]
+                path_id = frame[5][frame[6] - 1]
+                path_bit = 1 << path_id
+                del frame[3][path_id]
+                # this decision plays no part in the failure: jump back to the most recent culprit
+                if not conflict & path_bit:
+                    stack.pop()
+                    continue
+                frame[7] |= conflict & ~path_bit
+                result = None
+
+            frame = stack[-1]
+            allowed, chosen, others, reasons, extra_reasons, path_ids, position, culprits = frame
+            if position < len(path_ids):
+                frame[6] = position + 1
+                path_id = path_ids[position]
+                path_bit = 1 << path_id
+                reasons[path_id] = path_bit
+                # a single AND prunes the paths of every other ball crossing this one
+                node = (allowed & ~conflicts[path_id], chosen | path_bit, others, reasons, extra_reasons, chosen)
+            else:
+                nogoods.add(culprits)
+                stack.pop()
+                result = None, culprits
+
+
+def search_paths(table, nogoods=None, allowed=-1):
+    """
+    :param table: PathsTable of the golf course
+    :param nogoods: NogoodStore kept from a previous search on the same table (and the same allowed paths) and
+                    completed by this one (None for a new one)
+    :param allowed: bitset of the paths the search may choose (all of them by default)
+    :return: list of the chosen path ids (one per ball) or None if there is no solution
+    """
+    search = BackjumpSearch(table, nogoods, allowed)
+    search.run()
+    return search.solution
+
+
+def luby(run):
+    """
+    :param run: number of the run (from 1)
+    :return: term of the Luby sequence 1, 1, 2, 1, 1, 2, 4, 1, 1, 2, 1, 1, 2, 4, 8, ...
+    """
+    while True:
+        size = 1
+        while size < run:
+            size = size << 1 | 1
+        # run is the last term of a block of size 2^k - 1: it is 2^(k-1)
+        if size == run:
+            return (size + 1) >> 1
+        run -= size >> 1
+
+
+def restart_search(table, seed=0, nodes=RESTART_NODES, max_restarts=RESTARTS_LIMIT):
+    """
+    Search in runs of growing budget (nodes times the Luby sequence) with random ties, the nogoods learned by a run
+    being kept by the next ones: a run stuck in a bad part of the tree is cut short instead of exploring it to the end.
+    :param table: PathsTable of the golf course
+    :param seed: seed of the Random breaking the ties (same seed, same runs)
+    :param nodes: number of nodes of the first run
+    :param max_restarts: number of runs with a budget, the last run having none
+    :return: list of the chosen path ids (one per ball) or None if there is no solution
+    """
+    rng = Random(seed)
+    nogoods = NogoodStore()
+    for run in count(1):
+        search = BackjumpSearch(table, nogoods, rng=rng)
+        if search.run(nodes * luby(run) if run <= max_restarts else None):
+            return search.solution
+
+
+def restart_region(balls_candidate_paths, seed=0):
+    """
+    :param balls_candidate_paths: list of the candidate paths of each ball
+    :param seed: seed of the Random breaking the ties of the runs
+    :return: list of the chosen paths (one per ball) or None if there is no solution, found by restart_search
+    """
+    table = build_paths_table(balls_candidate_paths)
+    chosen_ids = restart_search(table, seed)
+    if chosen_ids is None:
+        return None
+    return [table.paths[path_id] for path_id in chosen_ids]
+
+
+def search_region(balls_candidate_paths):
+    """
+    :param balls_candidate_paths: list of the candidate paths of each ball
+    :return: list of the chosen paths (one per ball) or None if there is no solution
+    """
+    table = build_paths_table(balls_candidate_paths)
+    chosen_ids = search_paths(table)
+    if chosen_ids is None:
+        return None
+    return [table.paths[path_id] for path_id in chosen_ids]
+
+
+# state of the worker processes of parallel_region: the generation shared with their pool and the table of the region
+# being searched (set by init_search_worker and search_subtree)
+WORKER_STATE = {}
+# pools of processes of parallel_region, started at their first use and kept for the whole process: number of workers
+# -> (ProcessPoolExecutor, generation of the region searched, raised once it does not need its sub-trees anymore)
+SEARCH_POOLS = {}
+# a forked process starts its own pools (the workers of the inherited ones belong to its parent)
+register_at_fork(after_in_child=SEARCH_POOLS.clear)
+
+
+def init_search_worker(generation):
+    """
+    :param generation: shared generation of the pool, a sub-tree of an older one is given up
+    """
+    WORKER_STATE["generation"] = generation
+
+
+def search_subtree(region, table_name, allowed):
+    """
+    :param region: generation of the region of the sub-tree
+    :param table_name: name of the shared memory block of the pickled PathsTable of the region (unpickled once per
+                       worker and region)
+    :param allowed: bitset of the paths of the sub-tree
+    :return: list of the chosen path ids or None if the sub-tree has no solution (or the search has been cancelled)
+    """
+    generation = WORKER_STATE["generation"]
+    if generation.value != region:
+        return None
+    if WORKER_STATE.get("region") != region:
+        try:
+            block = SharedMemory(table_name)
+        except FileNotFoundError:
+            # the region is over and its block already freed
+            return None
+        try:
+            table = pickle_loads(block.buf)
+        finally:
+            block.close()
+        WORKER_STATE["region"] = region
+        WORKER_STATE["table"] = table
+    search = BackjumpSearch(WORKER_STATE["table"], allowed=allowed)
+    # the search is paused every CANCEL_CHECK_NODES nodes to look at the generation
+    while not search.run(CANCEL_CHECK_NODES):
+        if generation.value != region:
+            return None
+    return search.solution
+
+
+def search_pool(max_workers):
+    """
+    :param max_workers: number of worker processes
+    :return: (ProcessPoolExecutor, shared generation) of SEARCH_POOLS, created at the first call
+    """
+    pool = SEARCH_POOLS.get(max_workers)
+    if pool is None:
+        # the workers share the resource tracker of this process, which frees the table blocks of parallel_region
+        # left behind (a tracker of their own would free them at their exit instead)
+        ensure_resource_tracker()
+        generation = RawValue("q", 0)
+        executor = ProcessPoolExecutor(max_workers, initializer=init_search_worker, initargs=(generation,))
+        pool = SEARCH_POOLS[max_workers] = (executor, generation)
+    return pool
+
+
+def split_search(table, nb_subtrees):
+    """
+    Split the search tree at the root: the most constrained ball is given each of its paths in turn (least
+    constraining first), and the first sub-trees are split again the same way until there are enough of them.
+    :param table: PathsTable of the golf course
+    :param nb_subtrees: number of sub-trees wanted
+    :return: list of the bitsets of the paths allowed in each sub-tree (every solution is in one of them)
+    """
+    state, _ = propagate(table, -1, 0, list(range(len(table.domains))), {}, {})
+    if state is None:
+        return []
+    allowed, chosen, unplaced, _, _ = state
+    # the paths already chosen stay allowed: each of them is the only path left to its ball
+    subtrees = [(allowed, chosen, unplaced)]
+    split = []
+    while subtrees and len(subtrees) + len(split) < nb_subtrees:
+        allowed, chosen, unplaced = subtrees.pop(0)
+        if not unplaced:
+            split.append((allowed, chosen, unplaced))
+            continue
+        ball = choose_ball(table, allowed, unplaced)
+        others = [other for other in unplaced if other != ball]
+        for path_id in order_paths(table, allowed, ball):
+            subtrees.append((allowed & ~table.conflicts[path_id], chosen | 1 << path_id, others))
+    return [allowed | chosen for allowed, chosen, _ in split + subtrees]
+
+
+def shutdown_search_pools():
+    """
+    Stop the pools of SEARCH_POOLS: their running sub-trees are given up at their next look at the generation
+    """
+    for executor, generation in SEARCH_POOLS.values():
+        generation.value += 1
+        executor.shutdown(cancel_futures=True)
+    SEARCH_POOLS.clear()
+
+
+def parallel_region(balls_candidate_paths, max_workers=None):
+    """
+    :param balls_candidate_paths: list of the candidate paths of each ball
+    :param max_workers: number of worker processes (number of cores by default)
+    :return: list of the chosen paths (one per ball) or None if there is no solution, found by searching the sub-trees
+             of the root in the pool of processes of SEARCH_POOLS (the first solution found cancels the other
+             sub-trees); the regions with less than PARALLEL_MIN_BALLS balls are searched in this process
+    """
+    table = build_paths_table(balls_candidate_paths)
+    if max_workers is None:
+        max_workers = cpu_count() or 1
+    if len(table.domains) < PARALLEL_MIN_BALLS or max_workers == 1:
+        chosen_ids = search_paths(table)
+        return None if chosen_ids is None else [table.paths[path_id] for path_id in chosen_ids]
+
+    subtrees = split_search(table, max_workers * SUBTREES_PER_WORKER)
+    executor, generation = search_pool(max_workers)
+    region = generation.value
+    # the table is pickled once into a shared memory block read once by each worker, a sub-tree only sends its bitset
+    table_data = pickle_dumps(table, HIGHEST_PROTOCOL)
+    block = SharedMemory(create=True, size=len(table_data))
+    block.buf[:len(table_data)] = table_data
+    futures = []
+    try:
+        for allowed in subtrees:
+            futures.append(executor.submit(search_subtree, region, block.name, allowed))
+        for future in as_completed(futures):
+            chosen_ids = future.result()
+            if chosen_ids is not None:
+                return [table.paths[path_id] for path_id in chosen_ids]
+        return None
+    finally:
+        # the sub-trees not started are dropped, the running ones stop at their next look at the generation
+        generation.value = region + 1
+        for future in futures:
+            future.cancel()
+        block.close()
+        block.unlink()
+
+
+def hungarian(costs):
+    """
+    :param costs: matrix of the cost of each (ball, hole) pair (at least as many holes as balls, None if forbidden)
+    :return: (total cost, list of the hole assigned to each ball) of a minimum cost assignment, or None if every
+             assignment uses a forbidden pair
+    """
+    nb_balls = len(costs)
+    nb_holes = len(costs[0]) if costs else 0
+    if nb_balls > nb_holes:
+        return None
+    forbidden = 1 + sum(cost for row in costs for cost in row if cost is not None)
+    # potentials of the balls / holes (1-based, 0 is the virtual hole), ball matched to each hole
+    ball_potentials = [0.0] * (nb_balls + 1)
+    hole_potentials = [0.0] * (nb_holes + 1)
+    hole_ball = [0] * (nb_holes + 1)
+    for ball in range(1, nb_balls + 1):
+        hole_ball[0] = ball
+        current_hole = 0
+        min_slack = [float("inf")] * (nb_holes + 1)
+        previous_hole = [0] * (nb_holes + 1)
+        used = [False] * (nb_holes + 1)
+        while hole_ball[current_hole]:
+            used[current_hole] = True
+            current_ball = hole_ball[current_hole]
+            delta = float("inf")
+            next_hole = 0
+            for hole in range(1, nb_holes + 1):
+                if not used[hole]:
+                    cost = costs[current_ball - 1][hole - 1]
+                    if cost is None:
+                        cost = forbidden
+                    slack = cost - ball_potentials[current_ball] - hole_potentials[hole]
+                    if slack < min_slack[hole]:
+                        min_slack[hole] = slack
+                        previous_hole[hole] = current_hole
+                    if min_slack[hole] < delta:
+                        delta = min_slack[hole]
+                        next_hole = hole
+            for hole in range(nb_holes + 1):
+                if used[hole]:
+                    ball_potentials[hole_ball[hole]] += delta
+                    hole_potentials[hole] -= delta
+                else:
+                    min_slack[hole] -= delta
+            current_hole = next_hole
+        while current_hole:
+            hole_ball[current_hole] = hole_ball[previous_hole[current_hole]]
+            current_hole = previous_hole[current_hole]
 
-    # ball_direction setup (list of possible directions)
-    list_directions = get_ball_directions(golf_course, ball, distance, directions_strategy, water_just_crossed,
-                                          previous_direction)
-
-    for direction in list_directions:
-
-        is_golf_course_updated, water_just_crossed, golf_course_updated, ball_updated = update_golf_course(golf_course,
-                                                                                                           ball,
-                                                                                                           distance,
-                                                                                                           direction)
-        # if golf_course_updated:
-        #     print(finalize_golf_course(golf_course_updated))
-
-        # if the direction the ball just followed is not a failure
-        if is_golf_course_updated:
-            # go further in the different paths the ball can still follow
-            is_backtrack_ok, golf_course_updated = backtrack(golf_course_updated, ball_updated,
-                                                             distance - 1, directions_strategy, water_just_crossed,
-                                                             direction)
-            # case the ball just hit the hole
-            if is_backtrack_ok:
-                return True, golf_course_updated
-        # if the direction the ball just followed is a failure, try next direction
+    assignment = [0] * nb_balls
+    for hole in range(1, nb_holes + 1):
+        if hole_ball[hole]:
+            assignment[hole_ball[hole] - 1] = hole - 1
+    if any(costs[ball][hole] is None for ball, hole in enumerate(assignment)):
+        return None
+    return sum(costs[ball][hole] for ball, hole in enumerate(assignment)), assignment
+
+
+def murty_assignments(costs):
+    """
+    Murty's k-best assignments: after each assignment, the remaining ones are split into sub-problems (the first
+    balls keep their holes, the next one is forbidden its hole), each solved with the Hungarian algorithm.
+    :param costs: matrix of the cost of each (ball, hole) pair (None if forbidden)
+    :return: generator of the assignments (list of the hole of each ball), cheapest first
+    """
+    best = hungarian(costs)
+    if best is None:
+        return
+    # queue of (cost, counter, assignment, forced pairs, forbidden pairs)
+    queue = [(best[0], 0, best[1], (), frozenset())]
+    counter = 1
+    while queue:
+        _, _, assignment, forced, forbidden = heappop(queue)
+        yield assignment
+
+        forced_balls = {ball for ball, _ in forced}
+        for ball in range(len(costs)):
+            if ball in forced_balls:
+                continue
+            sub_forbidden = forbidden | {(ball, assignment[ball])}
+            sub_costs = [[None if (row, hole) in sub_forbidden else cost for hole, cost in enumerate(costs_row)]
+                         for row, costs_row in enumerate(costs)]
+            for forced_ball, forced_hole in forced:
+                for hole in range(len(costs[0])):
+                    if hole != forced_hole:
+                        sub_costs[forced_ball][hole] = None
+                for row in range(len(costs)):
+                    if row != forced_ball:
+                        sub_costs[row][forced_hole] = None
+            solution = hungarian(sub_costs)
+            if solution is not None:
+                heappush(queue, (solution[0], counter, solution[1], forced, sub_forbidden))
+                counter += 1
+            forced += ((ball, assignment[ball]),)
+            forced_balls.add(ball)
+
+
+def murty_region(balls_candidate_paths):
+    """
+    :param balls_candidate_paths: list of the candidate paths of each ball
+    :return: list of the chosen paths (one per ball) or None if there is no solution, found by trying the
+             ball-to-hole assignments best first (cost of a pair: paths of the other balls its paths rule out, divided
+             by its number of paths) and only searching paths for the assigned holes (after MURTY_LIMIT assignments,
+             the search goes on without assignment)
+    """
+    table = build_paths_table(balls_candidate_paths)
+    costs = [[None] * len(table.holes) for _ in table.domains]
+    for ball, ball_holes in enumerate(table.ball_holes):
+        others = ~table.domains[ball]
+        for hole, paths_to_hole in ball_holes:
+            ruled_out = 0
+            for path_id in iter_bits(paths_to_hole):
+                ruled_out |= table.conflicts[path_id]
+            costs[ball][hole] = ((ruled_out & others).bit_count() + 1) / paths_to_hole.bit_count()
+
+    for nb_assignments, assignment in enumerate(murty_assignments(costs)):
+        if nb_assignments == MURTY_LIMIT:
+            chosen_ids = search_paths(table)
         else:
+            allowed = 0
+            for ball, hole in enumerate(assignment):
+                allowed |= table.holes[hole] & table.domains[ball]
+            chosen_ids = search_paths(table, allowed=allowed)
+        if chosen_ids is not None:
+            return [table.paths[path_id] for path_id in chosen_ids]
+        if nb_assignments == MURTY_LIMIT:
+            break
+    return None
+
+
+def min_conflicts(table, max_steps=None, tabu_tenure=10, walk_probability=0.02, seed=0):
+    """
+    Min-conflicts local search: every ball always has a path, a ball in conflict is picked at random and moved to its
+    path crossing the fewest paths of the other balls (the path it just left is tabu for tabu_tenure steps, and a
+    random path is taken with walk_probability to escape plateaus).
+    :param table: PathsTable of the golf course
+    :param max_steps: maximum number of moves (100 per ball by default)
+    :param tabu_tenure: number of steps a ball cannot go back to the path it left
+    :param walk_probability: probability of a random move
+    :param seed: seed of the random generator
+    :return: (list of the path id of each ball, set of the balls still in conflict), or None if a ball has no path
+    """
+    if not all(table.domains):
+        return None
+    rnd = Random(seed)
+    nb_balls = len(table.domains)
+    if max_steps is None:
+        max_steps = 100 * nb_balls
+    conflicts = table.conflicts
+    path_balls = {path_id: ball for ball, domain in enumerate(table.domains) for path_id in iter_bits(domain)}
+    balls_paths = [list(iter_bits(domain)) for domain in table.domains]
+
+    # greedy start: each ball takes the path crossing the fewest paths already placed
+    current = 0
+    assignment = [None] * nb_balls
+    for ball in rnd.sample(range(nb_balls), nb_balls):
+        path_id = min(balls_paths[ball], key=lambda candidate: (conflicts[candidate] & current).bit_count())
+        assignment[ball] = path_id
+        current |= 1 << path_id
+    nb_conflicts = [(conflicts[assignment[ball]] & current & ~table.domains[ball]).bit_count()
+                    for ball in range(nb_balls)]
+    conflicted = {ball for ball in range(nb_balls) if nb_conflicts[ball]}
+    tabu = {}
+
+    for step in range(max_steps):
+        if not conflicted:
+            break
+        ball = rnd.choice(tuple(conflicted))
+        others = current & ~table.domains[ball]
+        if rnd.random() < walk_probability:
+            new_path_id = rnd.choice(balls_paths[ball])
+        else:
+            # best move (a tabu path is only taken if it removes every conflict of the ball)
+            best_count = None
+            for path_id in balls_paths[ball]:
+                count = (conflicts[path_id] & others).bit_count()
+                if tabu.get(path_id, -1) > step and count:
+                    continue
+                if best_count is None or count < best_count or (count == best_count and rnd.random() < 0.5):
+                    best_count, new_path_id = count, path_id
+            if best_count is None:
+                continue
+        old_path_id = assignment[ball]
+        if new_path_id == old_path_id:
             continue
 
-    # all directions have been a failure, no more possibility: fail
-    return False, None
+        # update the conflicts of the balls crossing the old / new path
+        tabu[old_path_id] = step + tabu_tenure
+        for other_path_id in iter_bits(conflicts[old_path_id] & others):
+            other = path_balls[other_path_id]
+            nb_conflicts[other] -= 1
+            if not nb_conflicts[other]:
+                conflicted.discard(other)
+        for other_path_id in iter_bits(conflicts[new_path_id] & others):
+            other = path_balls[other_path_id]
+            nb_conflicts[other] += 1
+            conflicted.add(other)
+        current ^= (1 << old_path_id) | (1 << new_path_id)
+        assignment[ball] = new_path_id
+        nb_conflicts[ball] = (conflicts[new_path_id] & others).bit_count()
+        if nb_conflicts[ball]:
+            conflicted.add(ball)
+        else:
+            conflicted.discard(ball)
 
+    return assignment, conflicted
 
-def find_another_order(list_to_shuffle, tuple_of_list, set_of_tuples):
-    while tuple_of_list in set_of_tuples:
-        rd_shuffle(list_to_shuffle)
-        tuple_of_list = tuple(list_to_shuffle)
-    set_of_tuples.add(tuple_of_list)
 
+def local_region(balls_candidate_paths):
+    """
+    :param balls_candidate_paths: list of the candidate paths of each ball
+    :return: list of the chosen paths (one per ball) or None if there is no solution, found by min-conflicts local
+             search; the conflicts left are solved exactly with the balls out of conflict kept on their paths, then
+             with the whole region if it fails
+    """
+    table = build_paths_table(balls_candidate_paths)
+    result = min_conflicts(table)
+    if result is None:
+        return None
+    assignment, conflicted = result
+    if not conflicted:
+        return [table.paths[path_id] for path_id in assignment]
+
+    allowed = 0
+    for ball, path_id in enumerate(assignment):
+        allowed |= table.domains[ball] if ball in conflicted else 1 << path_id
+    chosen_ids = search_paths(table, allowed=allowed)
+    if chosen_ids is None:
+        chosen_ids = search_paths(table)
+    if chosen_ids is None:
+        return None
+    return [table.paths[path_id] for path_id in chosen_ids]
 
-def get_possible_paths(golf_course, balls_distances, directions_strategy, set_balls_orders, set_directions_strategy):
+
+def dancing_links(balls_candidate_paths):
+    """
+    Exact cover of the balls with Knuth's Algorithm X on Dancing Links: every ball is a primary column (covered
+    exactly once), every cell of the golf course (holes included) is a secondary column (covered at most once) and
+    every candidate path is a row.
+    :param balls_candidate_paths: list of the candidate paths of each ball
+    :return: list of the chosen paths (one per ball) or None if there is no solution
     """
-    :param golf_course: golf course (start status)
+    # node 0 is the root, nodes 1..nb_balls are the ball headers, then come the cell headers and the path nodes
+    nb_balls = len(balls_candidate_paths)
+    left = [nb_balls] + list(range(nb_balls))
+    right = list(range(1, nb_balls + 1)) + [0]
+    up = list(range(nb_balls + 1))
+    down = list(range(nb_balls + 1))
+    column = list(range(nb_balls + 1))
+    size = [0] * (nb_balls + 1)
+    row_path = [None] * (nb_balls + 1)
+    cell_columns = {}
+
+    def add_node(col, path):
+        node = len(column)
+        column.append(col)
+        row_path.append(path)
+        up.append(up[col])
+        down.append(col)
+        down[up[col]] = node
+        up[col] = node
+        size[col] += 1
+        left.append(node)
+        right.append(node)
+        size.append(0)
+        return node
+
+    for ball_column, paths in enumerate(balls_candidate_paths, 1):
+        for path in paths:
+            first = add_node(ball_column, path)
+            for cell in iter_bits(path.mask):
+                if cell not in cell_columns:
+                    # secondary column: header linked to itself, never chosen by the search
+                    cell_columns[cell] = header = len(column)
+                    column.append(header)
+                    row_path.append(None)
+                    up.append(header)
+                    down.append(header)
+                    left.append(header)
+                    right.append(header)
+                    size.append(0)
+                node = add_node(cell_columns[cell], path)
+                left[node] = left[first]
+                right[node] = first
+                right[left[first]] = node
+                left[first] = node
+
+    def cover(col):
+        right[left[col]] = right[col]
+        left[right[col]] = left[col]
+        i = down[col]
+        while i != col:
+            j = right[i]
+            while j != i:
+                up[down[j]] = up[j]
+                down[up[j]] = down[j]
+                size[column[j]] -= 1
+                j = right[j]
+            i = down[i]
+
+    def uncover(col):
+        i = up[col]
+        while i != col:
+            j = left[i]
+            while j != i:
+                size[column[j]] += 1
+                up[down[j]] = j
+                down[up[j]] = j
+                j = left[j]
+            i = up[i]
+        right[left[col]] = col
+        left[right[col]] = col
+
+    solution = []
+
+    def select(row):
+        solution.append(row_path[row])
+        j = right[row]
+        while j != row:
+            cover(column[j])
+            j = right[j]
+
+    def unselect(row):
+        j = left[row]
+        while j != row:
+            uncover(column[j])
+            j = left[j]
+        solution.pop()
+
+    # the search runs on an explicit stack of frames [ball column covered, row being tried], so its depth does not
+    # depend on the Python stack
+    stack = []
+    while right[0] != 0:
+        # the ball with the fewest remaining paths first
+        col = right[0]
+        best = col
+        while col != 0:
+            if size[col] < size[best]:
+                best = col
+            col = right[col]
+        if size[best]:
+            cover(best)
+            stack.append([best, down[best]])
+            select(down[best])
+            continue
+        # this ball has no path left: next row of the deepest ball having one
+        while stack:
+            frame = stack[-1]
+            best, row = frame
+            unselect(row)
+            row = down[row]
+            if row != best:
+                frame[1] = row
+                select(row)
+                break
+            uncover(best)
+            stack.pop()
+        else:
+            return None
+    return solution
+
+
+def split_regions(balls_candidate_paths):
+    """
+    :param balls_candidate_paths: list of the candidate paths of each ball
+    :return: list of the independent regions of the golf course, each one the list of the numbers of its balls: two
+             balls are in the same region when some of their candidate paths share a cell or a hole (directly or
+             through other balls)
+    """
+    # union-find over the balls
+    parents = list(range(len(balls_candidate_paths)))
+
+    def find(ball):
+        while parents[ball] != ball:
+            parents[ball] = parents[parents[ball]]
+            ball = parents[ball]
+        return ball
+
+    cell_balls = {}
+    for ball, paths in enumerate(balls_candidate_paths):
+        cells = 0
+        for path in paths:
+            cells |= path.mask
+        for cell in iter_bits(cells):
+            other = cell_balls.setdefault(cell, ball)
+            parents[find(ball)] = find(other)
+
+    regions = {}
+    for ball in range(len(balls_candidate_paths)):
+        regions.setdefault(find(ball), []).append(ball)
+    return list(regions.values())
+
+
+class RegionCache:
+    """
+    LRU cache of the solved regions, keyed by the canonical form of their candidate paths (see canonical_region):
+    the same local pattern found again anywhere on a golf course (or on another one) is solved once.
+    """
+    __slots__ = ("maxsize", "symmetries", "overlays", "hits", "misses")
+
+    def __init__(self, maxsize=1024, symmetries=True):
+        """
+        :param maxsize: maximum number of regions kept (least recently used ones are evicted first)
+        :param symmetries: True to also match the regions under the 8 rotations / reflections, False for translation
+        """
+        self.maxsize = maxsize
+        self.symmetries = SYMMETRIES if symmetries else SYMMETRIES[:1]
+        self.overlays = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, key):
+        """
+        :param key: canonical key of a region
+        :return: (True, overlay) if the region is known (overlay is None if it has no solution), (False, None) if not
+        """
+        if key in self.overlays:
+            self.overlays.move_to_end(key)
+            self.hits += 1
+            return True, self.overlays[key]
+        self.misses += 1
+        return False, None
+
+    def store(self, key, overlay):
+        """
+        :param key: canonical key of a region
+        :param overlay: canonical signatures of the chosen paths of the region (None if it has no solution)
+        """
+        self.overlays[key] = overlay
+        self.overlays.move_to_end(key)
+        if len(self.overlays) > self.maxsize:
+            self.overlays.popitem(last=False)
+
+
+def canonical_region(balls_distances, balls_candidate_paths, symmetries):
+    """
+    :param balls_distances: list of the balls/distances of the region
+    :param balls_candidate_paths: list of the candidate paths of each ball of the region
+    :param symmetries: symmetries under which the regions are matched (SYMMETRIES or a subset)
+    :return: (key, signatures) where key is the smallest form of the region over the symmetries (balls translated
+             so that the region starts at (0, 0), arrows remapped) and signatures[i][j] the signature of the path j of
+             the ball i in this form
+    """
+    best_key = best_signatures = None
+    for a, b, c, d in symmetries:
+        arrows = {arrow: VECTOR_ARROWS[(a * row + b * col, c * row + d * col)]
+                  for arrow, (row, col) in ARROW_VECTORS.items()}
+        coords = [(a * row + b * col, c * row + d * col) for (row, col), _ in balls_distances]
+        top = min(row for row, _ in coords)
+        left = min(col for _, col in coords)
+        balls = []
+        signatures = []
+        for (row, col), (_, distance), paths in zip(coords, balls_distances, balls_candidate_paths):
+            ball = (row - top, col - left, distance)
+            path_signatures = [(ball, bytes(arrows[direction] for direction in path.directions)) for path in paths]
+            signatures.append(path_signatures)
+            balls.append((ball, tuple(sorted(directions for _, directions in path_signatures))))
+        key = tuple(sorted(balls))
+        if best_key is None or key < best_key:
+            best_key, best_signatures = key, signatures
+    return best_key, best_signatures
+
+
+def solve_cached_region(balls_distances, balls_candidate_paths, solve_region, region_cache):
+    """
+    :param balls_distances: list of the balls/distances of the region
+    :param balls_candidate_paths: list of the candidate paths of each ball of the region
+    :param solve_region: function choosing one path per ball of a region
+    :param region_cache: RegionCache of the regions already solved
+    :return: list of the chosen paths (one per ball) or None if there is no solution
+    """
+    key, signatures = canonical_region(balls_distances, balls_candidate_paths, region_cache.symmetries)
+    is_known, overlay = region_cache.lookup(key)
+    if is_known:
+        if overlay is None:
+            return None
+        # map the canonical overlay back onto the paths of this region
+        paths_by_signature = {signature: path for paths, path_signatures in zip(balls_candidate_paths, signatures)
+                              for path, signature in zip(paths, path_signatures)}
+        return [paths_by_signature[signature] for signature in overlay]
+
+    region_paths = solve_region(balls_candidate_paths)
+    if region_paths is None:
+        region_cache.store(key, None)
+    else:
+        signature_of = {path: signature for paths, path_signatures in zip(balls_candidate_paths, signatures)
+                        for path, signature in zip(paths, path_signatures)}
+        region_cache.store(key, tuple(signature_of[path] for path in region_paths))
+    return region_paths
+
+
+def get_possible_paths(grid, balls_distances, directions_strategy=DIRECTIONS_STRATEGY, solve_region=search_region,
+                       region_cache=None, shot_table=None):
+    """
+    :param grid: golf course (start status, GolfGrid updated in place)
     :param balls_distances: list of the balls/distances to analyse
+    :param directions_strategy: the order of the directions to respect (order of the candidate paths of each ball)
+    :param solve_region: function choosing one path per ball of a region (search_region or dancing_links)
+    :param region_cache: RegionCache of the regions already solved (None to solve every region)
+    :param shot_table: ShotTable of the golf course or of its terrain (built for this golf course if None)
+    :return: golf course (final status) or None if there is no solution
+    """
+    candidate_paths = get_balls_candidate_paths(grid, balls_distances, directions_strategy, shot_table)
+    balls_candidate_paths = [candidate_paths[ball] for ball, _ in balls_distances]
+    chosen_paths = []
+    # the independent regions are solved one by one: their costs add up instead of multiplying
+    for region in split_regions(balls_candidate_paths):
+        region_candidate_paths = [balls_candidate_paths[ball] for ball in region]
+        if region_cache is None:
+            region_paths = solve_region(region_candidate_paths)
+        else:
+            region_paths = solve_cached_region([balls_distances[ball] for ball in region], region_candidate_paths,
+                                               solve_region, region_cache)
+        if region_paths is None:
+            return None
+        chosen_paths.extend(region_paths)
+
+    for path in chosen_paths:
+        draw_path(grid, path)
+    return grid
+
+
+SOLVER_MODES = {"backtrack": search_region, "dlx": dancing_links, "murty": murty_region, "local": local_region,
+                "parallel": parallel_region, "restarts": restart_region}
+# regions solved so far by solve_golf_course (kept for the whole process)
+REGION_CACHE = RegionCache()
+
+
+def solve_golf_course(grid, balls_distances, mode="backtrack", directions_strategy=DIRECTIONS_STRATEGY,
+                      region_cache=REGION_CACHE):
+    """
+    :param grid: golf course (start status, GolfGrid updated in place)
+    :param balls_distances: list of the balls/distances to analyse
+    :param mode: "backtrack" (search on the conflict matrix of the candidate paths), "dlx" (exact cover with
+                 Dancing Links), "murty" (search driven by the best ball-to-hole assignments), "local" (min-conflicts
+                 local search for very large golf courses), "parallel" (search split between processes), "restarts"
+                 (search restarted on a Luby schedule with random ties) or "portfolio" (the searches of PORTFOLIO
+                 raced in separate processes, with their own directions strategies and without the region cache)
     :param directions_strategy: the order of the directions to respect
-    :param set_balls_orders: set of all balls orders we tried for this directions strategy
-    :param set_directions_strategy: set of all directions strategy we tried so far
-    :return: golf course (final status)
+    :param region_cache: RegionCache of the regions already solved (None to solve every region)
+    :return: golf course (final status) or None if there is no solution
     """
-    # need to copy the list because of recursion (to be able to go back to the previous state of golf course)
-    golf_course_updated = golf_course
-    # Loop through the balls
-    for ball_distance in balls_distances:
-        ball = ball_distance[0]
-        distance = ball_distance[1]
-        # check a possible path by ball
-        is_backtrack_ok, golf_course_updated = backtrack(golf_course_updated, ball, distance, directions_strategy)
-
-        # if golf_course_updated:
-        #     print(finalize_golf_course(golf_course_updated))
-
-        # if the ball didn't find a path, it means that it's because
-        # it has crossed another path or a hole already targeted
-        if not is_backtrack_ok:
-            # as long as we didn't try every possible ball order
-            if len(set_balls_orders) < factorial(len(balls_distances)):
-                # we push this ball_distance in front of the list (at the beginning)
-                balls_distances.remove(ball_distance)
-                balls_distances = [ball_distance] + balls_distances
-                t_balls_distances = tuple(balls_distances)
-                # we add this new order to the set of balls orders we already tried
-                if t_balls_distances not in set_balls_orders:
-                    set_balls_orders.add(t_balls_distances)
-                # if after having tried all possible "ball to the front" strategy, we randomly shuffle the balls order
-                else:
-                    find_another_order(balls_distances, t_balls_distances, set_balls_orders)
-            # if we tried every possible ball order, we alter the directions strategy
+    if mode == "portfolio":
+        return portfolio_golf_course(grid, balls_distances)
+    if mode not in SOLVER_MODES:
+        raise ValueError("unknown solver mode: {}".format(mode))
+    return get_possible_paths(grid, balls_distances, directions_strategy, SOLVER_MODES[mode], region_cache)
+
+
+BALLS_ORDERS = {"given": list, "reversed": lambda balls_distances: balls_distances[::-1],
+                "farthest": lambda balls_distances: sorted(balls_distances, key=lambda ball: -ball[1]),
+                "nearest": lambda balls_distances: sorted(balls_distances, key=lambda ball: ball[1])}
+
+
+def solve_portfolio_entry(grid, balls_distances, configuration, results, index):
+    """
+    Run one search of the portfolio (in its own process) and put (index, cells of the final course or None, None) in
+    results, or (index, None, description of the error) if the search fails
+    :param grid: golf course (start status, GolfGrid)
+    :param balls_distances: list of the balls/distances to analyse
+    :param configuration: (solver mode, directions strategy, balls order)
+    :param results: multiprocessing Queue shared by the searches
+    :param index: index of the configuration in the portfolio
+    """
+    mode, directions_strategy, balls_order = configuration
+    try:
+        final_grid = solve_golf_course(grid, BALLS_ORDERS[balls_order](balls_distances), mode, directions_strategy,
+                                       None)
+    except Exception as error:
+        results.put((index, None, "{}: {}".format(type(error).__name__, error)))
+    else:
+        results.put((index, None if final_grid is None else bytes(final_grid.cells), None))
+
+
+def portfolio_golf_course(grid, balls_distances, configurations=PORTFOLIO, timeout=None):
+    """
+    Race differently configured searches in separate processes: the first one to finish gives the answer (every mode
+    is complete, so a search finding no solution proves there is none) and the others are killed. A search failing
+    (error or killed process) leaves the race to the others.
+    :param grid: golf course (start status, GolfGrid updated in place)
+    :param balls_distances: list of the balls/distances to analyse
+    :param configurations: list of (solver mode, directions strategy, balls order) to race (see PORTFOLIO)
+    :param timeout: maximum time in seconds to wait for the first answer (None to wait as long as needed)
+    :return: golf course (final status) or None if there is no solution
+    :raise RuntimeError: if every search fails
+    """
+    for mode, _, balls_order in configurations:
+        if mode not in SOLVER_MODES:
+            raise ValueError("unknown solver mode: {}".format(mode))
+        if balls_order not in BALLS_ORDERS:
+            raise ValueError("unknown balls order: {}".format(balls_order))
+    results = Queue()
+    processes = [Process(target=solve_portfolio_entry, args=(grid, balls_distances, configuration, results, index),
+                         daemon=True)
+                 for index, configuration in enumerate(configurations)]
+    for process in processes:
+        process.start()
+    deadline = None if timeout is None else perf_counter() + timeout
+    errors = []
+    try:
+        while True:
+            # a search killed puts no result: once none is alive, the results they put are already in the queue
+            alive = any(process.is_alive() for process in processes)
+            wait = PORTFOLIO_POLL_TIME if deadline is None else min(PORTFOLIO_POLL_TIME, deadline - perf_counter())
+            try:
+                _, cells, error = results.get(timeout=max(wait, 0))
+            except Empty:
+                if deadline is not None and perf_counter() >= deadline:
+                    raise TimeoutError("no search of the portfolio finished in {}s".format(timeout)) from None
+                if not alive:
+                    raise RuntimeError("every search of the portfolio failed: {}".format(
+                        "; ".join(errors) or "processes killed")) from None
+                continue
+            if error is None:
+                break
+            errors.append(error)
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.join()
+    if cells is None:
+        return None
+    grid.cells[:] = cells
+    return grid
+
+
+class TerrainTemplate:
+    """
+    Golf course terrain (water and holes, without the balls) compiled once: its shot table (legal shots, landings,
+    water continuations) and the memo of the reachability oracle are shared by every ball configuration solved on it.
+    The table covers the biggest shot count solved so far and is compiled again when a bigger one comes. The compile
+    time and the time of the queries are measured separately.
+    """
+    __slots__ = ("grid", "shot_table", "compile_time", "queries", "query_time")
+
+    def __init__(self, terrain, max_distance=1):
+        """
+        :param terrain: rows of the golf course without balls ("." empty, "X" water, "H" hole)
+        :param max_distance: biggest shot count of the balls expected
+        """
+        self.grid = GolfGrid(terrain)
+        self.shot_table = None
+        self.compile_time = 0.0
+        self.queries = 0
+        self.query_time = 0.0
+        self.compile(max_distance)
+
+    def compile(self, max_distance):
+        """
+        Build the shot table again if it does not cover max_distance (the memo of the oracle starts again with it)
+        :param max_distance: biggest shot count of the balls to solve
+        """
+        if self.shot_table is not None and self.shot_table.max_distance >= max_distance:
+            return
+        start = perf_counter()
+        self.shot_table = build_shot_table(self.grid, max_distance)
+        self.compile_time += perf_counter() - start
+
+    def size(self):
+        """
+        :return: number of entries of the shot table (its memory grows with it)
+        """
+        return len(self.shot_table.transitions)
+
+    def solve(self, balls_distances, mode="backtrack", directions_strategy=DIRECTIONS_STRATEGY,
+              region_cache=REGION_CACHE):
+        """
+        :param balls_distances: list of the balls/distances placed on the terrain
+        :param mode: solver mode (see solve_golf_course, except "portfolio")
+        :param directions_strategy: the order of the directions to respect
+        :param region_cache: RegionCache of the regions already solved (None to solve every region)
+        :return: golf course (final status, new GolfGrid) or None if there is no solution
+        """
+        if mode not in SOLVER_MODES:
+            raise ValueError("unknown solver mode: {}".format(mode))
+        self.compile(max((distance for _, distance in balls_distances), default=0))
+        start = perf_counter()
+        grid = self.grid.copy()
+        for ball, distance in balls_distances:
+            grid.cells[grid.index(*ball)] = BALL + distance
+        final_grid = get_possible_paths(grid, balls_distances, directions_strategy, SOLVER_MODES[mode], region_cache,
+                                        self.shot_table)
+        self.queries += 1
+        self.query_time += perf_counter() - start
+        return final_grid
+
+    def report(self):
+        """
+        :return: text giving the compile time and the mean time of the queries
+        """
+        return "compile {:.3f}ms, {} queries, {:.3f}ms per query".format(
+            self.compile_time * 1000, self.queries, self.query_time * 1000 / self.queries if self.queries else 0.0)
+
+
+class TemplateCache:
+    """
+    LRU cache of the compiled TerrainTemplate, keyed by their terrain and bounded by the total size of their shot
+    tables (a template grows with its terrain and its biggest shot count)
+    """
+    __slots__ = ("maxsize", "templates", "hits", "misses")
+
+    def __init__(self, maxsize=TEMPLATES_CACHE_SIZE):
+        """
+        :param maxsize: maximum number of shot table entries kept (least recently used templates are evicted first,
+                        the last one used is always kept)
+        """
+        self.maxsize = maxsize
+        self.templates = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, terrain, max_distance=1):
+        """
+        :param terrain: rows of the golf course without balls
+        :param max_distance: biggest shot count of the balls to solve on it
+        :return: TerrainTemplate of the terrain covering max_distance (compiled if it is not in the cache or does not
+                 cover it)
+        """
+        key = "\n".join(terrain)
+        template = self.templates.get(key)
+        if template is None:
+            self.misses += 1
+            template = self.templates[key] = TerrainTemplate(terrain, max_distance)
+        else:
+            self.hits += 1
+            self.templates.move_to_end(key)
+            template.compile(max_distance)
+        # the templates may have grown since they were stored (compiled again by their solve)
+        size = sum(stored.size() for stored in self.templates.values())
+        while size > self.maxsize and len(self.templates) > 1:
+            _, evicted = self.templates.popitem(last=False)
+            size -= evicted.size()
+        return template
+
+
+# terrains compiled so far by solve_with_template (kept for the whole process)
+TERRAIN_TEMPLATES = TemplateCache()
+
+
+def split_terrain(rows):
+    """
+    :param rows: rows of the golf course in CodinGame format
+    :return: (rows of its terrain, the balls replaced by ".", list of the balls/distances)
+    """
+    terrain = []
+    balls_distances = []
+    for row_index, row in enumerate(rows):
+        terrain_row = []
+        for col, cell in enumerate(row):
+            if cell.isdigit():
+                balls_distances.append(((row_index, col), int(cell)))
+                cell = "."
+            terrain_row.append(cell)
+        terrain.append("".join(terrain_row))
+    return terrain, balls_distances
+
+
+def solve_with_template(rows, mode="backtrack", templates=TERRAIN_TEMPLATES):
+    """
+    :param rows: rows of the golf course in CodinGame format
+    :param mode: solver mode (see solve_golf_course, except "portfolio")
+    :param templates: TemplateCache of the compiled terrains
+    :return: golf course (final status) or None if there is no solution, solved on the template of its terrain
+    """
+    terrain, balls_distances = split_terrain(rows)
+    template = templates.get(terrain, max((distance for _, distance in balls_distances), default=0))
+    return template.solve(balls_distances, mode)
+
+
+def report_parallel_speedup(golf_course, balls_distances, workers_counts=None):
+    """
+    Print the time of the parallel search for each number of workers and its speed-up against a single worker
+    :param golf_course: golf course (start status, list of rows)
+    :param balls_distances: list of the balls/distances to analyse
+    :param workers_counts: numbers of workers to try (powers of 2 up to the number of cores by default)
+    :return: list of (number of workers, time in seconds, speed-up)
+    """
+    if workers_counts is None:
+        workers_counts = [1]
+        while workers_counts[-1] * 2 <= (cpu_count() or 1):
+            workers_counts.append(workers_counts[-1] * 2)
+    report = []
+    for max_workers in workers_counts:
+        # the workers are started before the timing (the pool is reused by the next searches)
+        if max_workers > 1:
+            search_pool(max_workers)[0].submit(int).result()
+        start = perf_counter()
+        get_possible_paths(GolfGrid(golf_course), balls_distances, DIRECTIONS_STRATEGY,
+                           partial(parallel_region, max_workers=max_workers))
+        elapsed = perf_counter() - start
+        speedup = report[0][1] / elapsed if report else 1.0
+        report.append((max_workers, elapsed, speedup))
+        print("{} worker(s): {:.3f}s, speed-up x{:.2f}".format(max_workers, elapsed, speedup))
+    return report
+
+
+def golf_course_error(rows):
+    """
+    :param rows: rows of a golf course in CodinGame format, as read from a corpus (or the ValueError of a corpus line
+                 that could not be read, see read_jsonl_golf_courses)
+    :return: description of the first problem of the rows or None if they are a golf course (a non empty list of
+             strings of the same width made of GOLF_COURSE_CHARS)
+    """
+    if isinstance(rows, ValueError):
+        return str(rows)
+    if not isinstance(rows, list) or not rows or not all(isinstance(row, str) for row in rows):
+        return "expected a non empty list of rows"
+    width = len(rows[0])
+    if not width:
+        return "row 1: empty row"
+    for row_number, row in enumerate(rows, 1):
+        if len(row) != width:
+            return "row {}: expected {} cells, got {}".format(row_number, width, len(row))
+        if not GOLF_COURSE_CHARS.issuperset(row):
+            return "row {}: unexpected cells in {!r}".format(row_number, row)
+    return None
+
+
+def parse_golf_course(rows):
+    """
+    :param rows: rows of the golf course in CodinGame format ("." empty, "X" water, "H" hole, digits balls)
+    :return: (GolfGrid of the golf course, list of the balls/distances), read in a single pass over the cells
+    :raise ValueError: if the rows are not a golf course (see golf_course_error)
+    """
+    error = golf_course_error(rows)
+    if error is not None:
+        raise ValueError(error)
+    grid = GolfGrid(rows)
+    cells = grid.cells
+    balls_distances = []
+    for row_index in range(grid.height):
+        start = grid.index(row_index, 0)
+        for col, code in enumerate(cells[start:start + grid.width]):
+            if code >= BALL:
+                balls_distances.append(((row_index, col), code - BALL))
+    return grid, balls_distances
+
+
+def read_golf_courses(lines, name="<stdin>"):
+    """
+    Stream the golf courses of a text in CodinGame format: each one is a "width height" line followed by its rows
+    (blank lines between the golf courses are skipped)
+    :param lines: iterable of the lines of the text (read one by one)
+    :param name: name of the text for the identifiers and the errors
+    :return: generator of (identifier "name:line of the header", list of the rows)
+    """
+    lines = iter(lines)
+    line_number = 0
+    for line in lines:
+        line_number += 1
+        header = line.split()
+        if not header:
+            continue
+        try:
+            width, height = map(int, header)
+        except ValueError:
+            raise ValueError("{}:{}: expected \"width height\", got {!r}".format(name, line_number, line)) from None
+        header_number = line_number
+        rows = []
+        for line in lines:
+            line_number += 1
+            row = line.strip()
+            if len(row) != width:
+                raise ValueError("{}:{}: expected a row of {} cells, got {!r}".format(name, line_number, width, line))
+            rows.append(row)
+            if len(rows) == height:
+                break
+        if len(rows) != height:
+            raise ValueError("{}:{}: golf course cut after {} rows".format(name, line_number, len(rows)))
+        yield "{}:{}".format(name, header_number), rows
+
+
+def read_jsonl_golf_courses(lines, name="<stdin>"):
+    """
+    Stream the golf courses of a JSONL corpus: each line is an object with the rows of a golf course ("rows": list of
+    strings) or its CodinGame text ("input": string), and optionally its identifier ("id"). A line that cannot be read
+    gives a ValueError in place of its rows, reported on its result (see golf_course_error) so the next lines and the
+    checkpoint go on.
+    :param lines: iterable of the lines of the corpus (read one by one)
+    :param name: name of the corpus for the identifiers and the errors
+    :return: generator of (identifier, list of the rows or ValueError)
+    """
+    for line_number, line in enumerate(lines, 1):
+        if not line.strip():
+            continue
+        location = "{}:{}".format(name, line_number)
+        try:
+            puzzle = json_loads(line)
+        except ValueError as error:
+            yield location, ValueError("invalid JSON: {}".format(error))
+            continue
+        if not isinstance(puzzle, dict):
+            yield location, ValueError("expected a JSON object, got {!r}".format(line.strip()))
+            continue
+        yield read_jsonl_golf_course(puzzle, location)
+
+
+def read_jsonl_golf_course(puzzle, location):
+    """
+    :param puzzle: JSON object of a line of a JSONL corpus (see read_jsonl_golf_courses)
+    :param location: "name:line" of the line, its identifier if it has no "id"
+    :return: (identifier, list of the rows or ValueError if the object does not give them)
+    """
+    identifier = puzzle.get("id", location)
+    if "rows" in puzzle:
+        return identifier, puzzle["rows"]
+    if not isinstance(puzzle.get("input"), str):
+        return identifier, ValueError("expected \"rows\" (list of strings) or \"input\" (string)")
+    try:
+        golf_courses = list(read_golf_courses(puzzle["input"].splitlines(), location))
+    except ValueError as error:
+        return identifier, error
+    if len(golf_courses) != 1:
+        return identifier, ValueError("expected one golf course in \"input\", got {}".format(len(golf_courses)))
+    return identifier, golf_courses[0][1]
+
+
+def iter_golf_courses(paths, jsonl=False):
+    """
+    :param paths: paths of the files to read one after the other ("-" for the standard input)
+    :param jsonl: True if the files are JSONL corpora, False if they are CodinGame texts
+    :return: generator of (identifier, list of the rows) over every golf course, every file being read lazily
+    """
+    read = read_jsonl_golf_courses if jsonl else read_golf_courses
+    for path in paths:
+        if path == "-":
+            yield from read(sys.stdin, "<stdin>")
+        else:
+            with open(path) as lines:
+                yield from read(lines, path)
+
+
+def transform_rows(rows, symmetry):
+    """
+    :param rows: rows of a golf course (start or final status)
+    :param symmetry: rotation / reflection (a, b, c, d) of SYMMETRIES
+    :return: rows of the golf course turned by the symmetry (arrows remapped)
+    """
+    a, b, c, d = symmetry
+    arrow_chars = {code: arrow for arrow, code in ARROW_CODES.items()}
+    arrows = {arrow: arrow_chars[VECTOR_ARROWS[(a * row + b * col, c * row + d * col)]]
+              for arrow, (row, col) in ((arrow, ARROW_VECTORS[code]) for arrow, code in ARROW_CODES.items())}
+    height, width = len(rows), len(rows[0])
+    corners = [(a * row + b * col, c * row + d * col) for row in (0, height - 1) for col in (0, width - 1)]
+    top = min(row for row, _ in corners)
+    left = min(col for _, col in corners)
+    new_rows = [[None] * (width if a else height) for _ in range(height if a else width)]
+    for row_index, row in enumerate(rows):
+        for col, char in enumerate(row):
+            new_rows[a * row_index + b * col - top][c * row_index + d * col - left] = arrows.get(char, char)
+    return ["".join(row) for row in new_rows]
+
+
+def canonical_golf_course(rows):
+    """
+    :param rows: rows of a golf course (start status)
+    :return: (hash of the smallest form of the golf course over the 8 symmetries, symmetry giving this form)
+    """
+    best_text = best_symmetry = None
+    for symmetry in SYMMETRIES:
+        text = "\n".join(transform_rows(rows, symmetry))
+        if best_text is None or text < best_text:
+            best_text, best_symmetry = text, symmetry
+    return sha256(best_text.encode("ascii")).hexdigest(), best_symmetry
+
+
+class SolutionCache:
+    """
+    Persistent cache of the solved golf courses in a sqlite file, keyed by their canonical form (see
+    canonical_golf_course) so a golf course turned or mirrored is found too. Each process opens its own connection
+    (write-ahead log, so pool workers and other processes can read and write the same file at once) and the least
+    recently used golf courses are evicted past maxsize.
+    """
+    __slots__ = ("path", "maxsize", "connection", "pid", "hits", "misses")
+
+    def __init__(self, path, maxsize=100000):
+        """
+        :param path: sqlite file of the cache (created if needed)
+        :param maxsize: maximum number of golf courses kept
+        """
+        self.path = path
+        self.maxsize = maxsize
+        self.connection = None
+        self.pid = None
+        self.hits = 0
+        self.misses = 0
+
+    def __getstate__(self):
+        # the connection stays in its process
+        return self.path, self.maxsize
+
+    def __setstate__(self, state):
+        self.__init__(*state)
+
+    def connect(self):
+        """
+        :return: sqlite connection of this process (opened the first time)
+        """
+        if self.pid != getpid():
+            self.connection = sqlite_connect(self.path, timeout=30, isolation_level=None)
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("PRAGMA synchronous=NORMAL")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS solutions (key TEXT PRIMARY KEY, solution TEXT, "
+                                    "used REAL)")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS solutions_used ON solutions (used)")
+            self.pid = getpid()
+        return self.connection
+
+    def lookup(self, rows):
+        """
+        :param rows: rows of a golf course (start status)
+        :return: (True, final golf course rows or None if it has no solution) if the golf course is known, (False,
+                 None) if not
+        """
+        key, symmetry = canonical_golf_course(rows)
+        connection = self.connect()
+        found = connection.execute("SELECT solution FROM solutions WHERE key = ?", (key,)).fetchone()
+        if found is None:
+            self.misses += 1
+            return False, None
+        self.hits += 1
+        connection.execute("UPDATE solutions SET used = ? WHERE key = ?", (time(), key))
+        if found[0] is None:
+            return True, None
+        # back from the canonical form: the inverse of a symmetry is its transpose
+        a, b, c, d = symmetry
+        return True, transform_rows(found[0].split("\n"), (a, c, b, d))
+
+    def store(self, rows, solution):
+        """
+        :param rows: rows of a golf course (start status)
+        :param solution: final golf course rows or None if it has no solution
+        """
+        key, symmetry = canonical_golf_course(rows)
+        connection = self.connect()
+        canonical_solution = None if solution is None else "\n".join(transform_rows(solution, symmetry))
+        connection.execute("INSERT OR REPLACE INTO solutions VALUES (?, ?, ?)", (key, canonical_solution, time()))
+        size, = connection.execute("SELECT COUNT(*) FROM solutions").fetchone()
+        if size > self.maxsize:
+            connection.execute("DELETE FROM solutions WHERE key IN (SELECT key FROM solutions ORDER BY used LIMIT ?)",
+                               (size - self.maxsize,))
+
+    def report(self):
+        """
+        :return: text giving the hits and misses of this process
+        """
+        lookups = self.hits + self.misses
+        return "cache: {} hits / {} lookups ({:.1f}%)".format(self.hits, lookups,
+                                                               100.0 * self.hits / lookups if lookups else 0.0)
+
+
+def solve_golf_courses(golf_courses, mode="backtrack", start=0, cache=None):
+    """
+    :param golf_courses: iterable of (identifier, list of the rows) (see iter_golf_courses)
+    :param mode: solver mode (see solve_golf_course)
+    :param start: number of golf courses to skip (already solved before a checkpoint)
+    :param cache: SolutionCache of the golf courses already solved (None for no cache)
+    :return: generator of (position in the stream, identifier, final golf course rows or None if there is no
+             solution, error (rows that are not a golf course, see golf_course_error) or None, solving time in seconds,
+             True if found in the cache), each golf course being solved when the next result is asked for
+    """
+    for position, (identifier, rows) in enumerate(golf_courses):
+        if position < start:
+            continue
+        yield (position, identifier) + solve_rows(rows, mode, cache)
+
+
+def solve_rows(rows, mode, cache=None):
+    """
+    :param rows: rows of the golf course in CodinGame format
+    :param mode: solver mode (see solve_golf_course)
+    :param cache: SolutionCache of the golf courses already solved (None for no cache)
+    :return: (final golf course rows or None if there is no solution, error (see golf_course_error) or None, solving
+             time in seconds, True if found in the cache)
+    """
+    start = perf_counter()
+    error = golf_course_error(rows)
+    if error is not None:
+        return None, error, perf_counter() - start, False
+    if cache is not None:
+        found, solution = cache.lookup(rows)
+        if found:
+            return solution, None, perf_counter() - start, True
+    grid, balls_distances = parse_golf_course(rows)
+    final_grid = solve_golf_course(grid, balls_distances, mode)
+    solution = None if final_grid is None else finalize_golf_course(final_grid).split()
+    if cache is not None:
+        cache.store(rows, solution)
+    return solution, None, perf_counter() - start, False
+
+
+def estimate_difficulty(rows):
+    """
+    :param rows: rows of the golf course in CodinGame format
+    :return: number of shot sequences of its balls (4 * 3 ^ (distance - 1) each), a cheap estimate of its cost (0 if
+             the rows are not a golf course, they are rejected at once)
+    """
+    if golf_course_error(rows) is not None:
+        return 0
+    return sum(4 * 3 ** (int(cell) - 1) for row in rows for cell in row if "1" <= cell <= "9")
+
+
+def chunk_golf_courses(golf_courses, start=0, chunk_difficulty=BATCH_CHUNK_DIFFICULTY,
+                       chunk_size=BATCH_CHUNK_SIZE):
+    """
+    :param golf_courses: iterable of (identifier, list of the rows) (see iter_golf_courses)
+    :param start: number of golf courses to skip (already solved before a checkpoint)
+    :param chunk_difficulty: estimated difficulty (see estimate_difficulty) closing a chunk
+    :param chunk_size: maximum number of golf courses of a chunk
+    :return: generator of lists of (position in the stream, identifier, rows): many easy golf courses are sent to a
+             worker at once, a hard one alone
+    """
+    chunk = []
+    difficulty = 0
+    for position, (identifier, rows) in enumerate(golf_courses):
+        if position < start:
+            continue
+        chunk.append((position, identifier, rows))
+        difficulty += estimate_difficulty(rows)
+        if difficulty >= chunk_difficulty or len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+            difficulty = 0
+    if chunk:
+        yield chunk
+
+
+def exit_batch_worker(signum, frame):
+    """
+    SIGTERM handler of the batch workers: exit through the finally blocks, so the processes started by the worker
+    ("parallel" pools, "portfolio" searches) are stopped with it
+    """
+    raise SystemExit(128 + signum)
+
+
+def batch_worker(connection, mode, cache=None):
+    """
+    Solve the chunks of golf courses received on the connection (until None) and send back each result as soon as
+    it is found
+    :param connection: end of the Pipe of the worker
+    :param mode: solver mode (see solve_golf_course)
+    :param cache: SolutionCache of the golf courses already solved (None for no cache)
+    """
+    signal(SIGTERM, exit_batch_worker)
+    # the processes forked by the worker are terminated the default way
+    register_at_fork(after_in_child=partial(signal, SIGTERM, SIG_DFL))
+    try:
+        while True:
+            chunk = connection.recv()
+            if chunk is None:
+                break
+            for position, identifier, rows in chunk:
+                connection.send((position, identifier) + solve_rows(rows, mode, cache))
+    finally:
+        shutdown_search_pools()
+
+
+class BatchWorker:
+    """
+    Worker process of solve_golf_courses_pool with the chunk it is solving: the first golf course left in the chunk
+    is the one being solved since started. The process is not daemonic, so it may start processes of its own (modes
+    "parallel" and "portfolio"): it is stopped by stop or kill.
+    """
+    __slots__ = ("process", "connection", "chunk", "started")
+
+    def __init__(self, mode, cache=None):
+        """
+        :param mode: solver mode (see solve_golf_course)
+        :param cache: SolutionCache of the golf courses already solved (None for no cache)
+        """
+        self.connection, worker_connection = Pipe()
+        self.process = Process(target=batch_worker, args=(worker_connection, mode, cache))
+        self.process.start()
+        worker_connection.close()
+        self.chunk = []
+        self.started = None
+
+    def send(self, chunk):
+        """
+        :param chunk: list of (position in the stream, identifier, rows) to solve
+        """
+        self.chunk = list(chunk)
+        self.started = perf_counter()
+        self.connection.send(chunk)
+
+    def stop(self):
+        """
+        Ask the idle process to exit and wait for it
+        """
+        try:
+            self.connection.send(None)
+        except OSError:
+            # the process is already gone
+            pass
+        self.process.join()
+        self.connection.close()
+
+    def kill(self):
+        """
+        Kill the process (its pipe is dropped with it, so nothing half written can be read)
+        """
+        self.process.terminate()
+        self.process.join()
+        self.connection.close()
+
+
+def solve_golf_courses_pool(golf_courses, mode="backtrack", start=0, workers=None, timeout=None, in_order=True,
+                            cache=None):
+    """
+    Solve a stream of golf courses in a pool of processes: chunks sized by difficulty (chunk_golf_courses) are given
+    to the idle workers, a worker solving a golf course for longer than timeout is killed and replaced (the rest of its
+    chunk goes to the new worker) and the chunks are read from the stream only when a worker is idle.
+    :param golf_courses: iterable of (identifier, list of the rows) (see iter_golf_courses)
+    :param mode: solver mode (see solve_golf_course)
+    :param start: number of golf courses to skip (already solved before a checkpoint)
+    :param workers: number of worker processes (number of cores by default)
+    :param timeout: maximum time in seconds to solve a golf course (None for no limit)
+    :param in_order: True to give the results in the order of the stream, False as soon as they are found
+    :param cache: SolutionCache shared by the workers (None for no cache)
+    :return: generator of (position in the stream, identifier, final golf course rows or None if there is no
+             solution, error ("timeout" or "worker failed") or None, solving time in seconds, True if found in the
+             cache)
+    """
+    if workers is not None and workers < 0:
+        raise ValueError("number of workers must be 0 (one per core) or more: {}".format(workers))
+    if timeout is not None and timeout <= 0:
+        raise ValueError("timeout must be positive: {}".format(timeout))
+    chunks = chunk_golf_courses(golf_courses, start)
+    pool = [BatchWorker(mode, cache) for _ in range(workers or cpu_count() or 1)]
+    # results waiting for the ones before them (in order)
+    waiting = {}
+    next_position = start
+    try:
+        while True:
+            for worker in pool:
+                if not worker.chunk:
+                    chunk = next(chunks, None)
+                    if chunk is None:
+                        break
+                    worker.send(chunk)
+            busy = [worker for worker in pool if worker.chunk]
+            if not busy:
+                break
+
+            wait_time = None
+            if timeout is not None:
+                wait_time = max(0.0, min(worker.started for worker in busy) + timeout - perf_counter())
+            ready = wait_connections([worker.connection for worker in busy], wait_time)
+            results = []
+            for index, worker in enumerate(pool):
+                if not worker.chunk:
+                    continue
+                error = None
+                if worker.connection in ready:
+                    try:
+                        results.append(worker.connection.recv())
+                        worker.chunk.pop(0)
+                        worker.started = perf_counter()
+                        continue
+                    except EOFError:
+                        error = "worker failed"
+                elif timeout is not None and perf_counter() - worker.started >= timeout:
+                    error = "timeout"
+                if error is not None:
+                    # the golf course is given up, the rest of the chunk goes to a new worker
+                    worker.kill()
+                    position, identifier, _ = worker.chunk.pop(0)
+                    results.append((position, identifier, None, error, perf_counter() - worker.started, False))
+                    pool[index] = BatchWorker(mode, cache)
+                    if worker.chunk:
+                        pool[index].send(worker.chunk)
+
+            for result in results:
+                if not in_order:
+                    yield result
+                    continue
+                waiting[result[0]] = result
+                while next_position in waiting:
+                    yield waiting.pop(next_position)
+                    next_position += 1
+    finally:
+        for worker in pool:
+            if worker.chunk:
+                worker.kill()
+            else:
+                worker.stop()
+
+
+def batch_report(latencies, elapsed, cache_hits=None):
+    """
+    :param latencies: solving times of the golf courses in seconds
+    :param elapsed: time of the whole batch in seconds
+    :param cache_hits: number of golf courses found in the cache (None without cache)
+    :return: text giving the throughput, the 50th, 95th and 99th percentiles of the latencies and the cache hit rate
+    """
+    latencies = sorted(latencies)
+    percentiles = []
+    for percentile in (50, 95, 99):
+        # nearest rank
+        rank = max(0, -(-percentile * len(latencies) // 100) - 1)
+        percentiles.append("p{} {:.3f}s".format(percentile, latencies[rank] if latencies else 0.0))
+    report = "{} golf courses in {:.3f}s: {:.1f} per second, {}".format(
+        len(latencies), elapsed, len(latencies) / elapsed if elapsed else 0.0, ", ".join(percentiles))
+    if cache_hits is not None:
+        # a first run on a new cache gives the cold hit rate, a run on the same golf courses the warm one
+        report += ", cache hits {} ({:.1f}%)".format(cache_hits,
+                                                     100.0 * cache_hits / len(latencies) if latencies else 0.0)
+    return report
+
+
+def read_checkpoint(path):
+    """
+    :param path: checkpoint file (None for no checkpoint)
+    :return: number of golf courses already solved (0 if the file does not exist)
+    """
+    if path is None:
+        return 0
+    try:
+        with open(path) as checkpoint:
+            return int(checkpoint.read())
+    except FileNotFoundError:
+        return 0
+
+
+def write_checkpoint(path, done):
+    """
+    :param path: checkpoint file (replaced atomically, so an interruption leaves the previous checkpoint)
+    :param done: number of golf courses solved and written out
+    """
+    with open(path + ".tmp", "w") as checkpoint:
+        checkpoint.write(str(done))
+    os_replace(path + ".tmp", path)
+
+
+def result_json(identifier, solution, error=None):
+    """
+    :param identifier: identifier of the golf course
+    :param solution: final golf course rows or None if there is no solution
+    :param error: why the golf course could not be solved or None
+    :return: JSON text of the result
+    """
+    result = {"id": identifier, "solution": solution}
+    if error is not None:
+        result["error"] = error
+    return json_dumps(result)
+
+
+def write_result(output, identifier, solution, jsonl, error=None):
+    """
+    :param output: text stream of the results
+    :param identifier: identifier of the golf course
+    :param solution: final golf course rows or None if there is no solution
+    :param jsonl: True to write a JSON line, False to write the rows (or "no solution", or the error) and a blank line
+    :param error: why the golf course could not be solved ("timeout" or "worker failed") or None
+    """
+    if jsonl:
+        output.write(result_json(identifier, solution, error) + "\n")
+    elif error is not None:
+        output.write(error + "\n\n")
+    elif solution is None:
+        output.write("no solution\n\n")
+    else:
+        output.write("\n".join(solution) + "\n\n")
+
+
+def batch_main(argv=None):
+    """
+    Solve a stream of golf courses (CodinGame texts or JSONL corpora) and write every result as soon as it is found.
+    With a checkpoint file, the number of golf courses done is saved after each result and an interrupted run starts
+    again after them. With several workers, the golf courses are solved by solve_golf_courses_pool.
+    :param argv: command line arguments (sys.argv[1:] if None)
+    """
+    parser = ArgumentParser(description="Solve Winamax golf courses in CodinGame format")
+    parser.add_argument("paths", nargs="*", default=["-"], help="files to solve (- for the standard input)")
+    parser.add_argument("--jsonl", action="store_true", help="the files are JSONL corpora")
+    parser.add_argument("--mode", default="backtrack", choices=sorted(SOLVER_MODES) + ["portfolio"])
+    parser.add_argument("--output-jsonl", action="store_true", help="write the results as JSON lines")
+    parser.add_argument("--checkpoint", help="file keeping the number of golf courses already solved")
+    parser.add_argument("--start", type=int, help="number of golf courses to skip (default: from the checkpoint)")
+    parser.add_argument("--workers", type=int, default=1, help="worker processes (0 for one per core)")
+    parser.add_argument("--timeout", type=float, help="seconds before a golf course is given up (with workers)")
+    parser.add_argument("--as-completed", action="store_true", help="write the results as soon as they are found")
+    parser.add_argument("--report", action="store_true", help="print the throughput and latencies on stderr")
+    parser.add_argument("--cache", help="sqlite file of the solutions kept from run to run")
+    parser.add_argument("--cache-size", type=int, default=100000, help="maximum number of solutions kept")
+    args = parser.parse_args(argv)
+    if args.workers < 0:
+        parser.error("--workers must be 0 (one per core) or more")
+    if args.timeout is not None and args.timeout <= 0:
+        parser.error("--timeout must be positive")
+
+    start = args.start if args.start is not None else read_checkpoint(args.checkpoint)
+    golf_courses = iter_golf_courses(args.paths, args.jsonl)
+    cache = None if args.cache is None else SolutionCache(args.cache, args.cache_size)
+    if args.workers == 1 and args.timeout is None:
+        results = solve_golf_courses(golf_courses, args.mode, start, cache)
+    else:
+        results = solve_golf_courses_pool(golf_courses, args.mode, start, args.workers, args.timeout,
+                                          not args.as_completed, cache)
+    batch_start = perf_counter()
+    latencies = []
+    cache_hits = 0
+    # positions written after a missing one (as completed): the checkpoint only covers the first ones
+    written = set()
+    done = start
+    try:
+        for position, identifier, solution, error, elapsed, cached in results:
+            write_result(sys.stdout, identifier, solution, args.output_jsonl, error)
+            sys.stdout.flush()
+            latencies.append(elapsed)
+            cache_hits += cached
+            written.add(position)
+            while done in written:
+                written.remove(done)
+                done += 1
+            if args.checkpoint is not None:
+                write_checkpoint(args.checkpoint, done)
+    except ValueError as error:
+        # a CodinGame text cannot be read past a broken golf course (the results before it are written and saved)
+        parser.exit(1, "{}: error: {}\n".format(parser.prog, error))
+    finally:
+        # the workers are stopped even if the output fails
+        results.close()
+    if args.report:
+        print(batch_report(latencies, perf_counter() - batch_start, None if cache is None else cache_hits),
+              file=sys.stderr)
+
+
+# solution cache of the worker processes of SolveServer (set once per worker by init_server_worker)
+SERVER_WORKER_STATE = {}
+
+
+def init_server_worker(cache):
+    """
+    :param cache: SolutionCache of the server (None for no cache), unpickled once per worker so its connection and
+                  counters are kept from request to request
+    """
+    SERVER_WORKER_STATE["cache"] = cache
+
+
+def solve_server_request(rows, mode):
+    """
+    :param rows: rows of the golf course in CodinGame format
+    :param mode: solver mode (see solve_golf_course)
+    :return: result of solve_rows with the cache of the worker
+    """
+    return solve_rows(rows, mode, SERVER_WORKER_STATE["cache"])
+
+
+async def read_request_line(reader):
+    """
+    :param reader: StreamReader of a connection
+    :return: next line (b"" at the end of the connection) or None if it is longer than the limit of the reader (the
+             line is then skipped up to its end)
+    """
+    try:
+        return await reader.readuntil(b"\n")
+    except IncompleteReadError as error:
+        # last line without its newline
+        return error.partial
+    except LimitOverrunError as error:
+        consumed = error.consumed
+    while True:
+        # the bytes buffered are dropped until the end of the line comes within the limit
+        await reader.readexactly(consumed)
+        try:
+            await reader.readuntil(b"\n")
+            return None
+        except IncompleteReadError:
+            return None
+        except LimitOverrunError as error:
+            consumed = error.consumed
+
+
+class SolveServer:
+    """
+    Line protocol server solving golf courses in a pool of processes: every request line is a JSON object as in a
+    JSONL corpus (see read_jsonl_golf_courses) and gets back a JSON line {"id", "solution"} (with "error" if it failed),
+    in the order the golf courses are solved. Identical golf courses waiting or being solved are solved once, and the
+    reading of a connection waits while the queue of golf courses to solve is full. A request that cannot be read
+    (not JSON, not a golf course, longer than line_limit) gets an error line and the connection goes on: its "id" is
+    the one of the request when it could be parsed, null otherwise (a line that is not a JSON object or is too long).
+    """
+    __slots__ = ("mode", "cache", "workers", "queue_size", "line_limit", "executor", "queue", "in_flight", "solved",
+                 "coalesced")
+
+    def __init__(self, mode="backtrack", workers=None, queue_size=SERVER_QUEUE_SIZE, cache=None,
+                 line_limit=SERVER_LINE_LIMIT):
+        """
+        :param mode: solver mode (see solve_golf_course)
+        :param workers: number of worker processes (number of cores by default)
+        :param queue_size: maximum number of golf courses waiting for a worker
+        :param cache: SolutionCache shared by the workers (None for no cache)
+        :param line_limit: maximum length in bytes of a request line
+        """
+        self.mode = mode
+        self.cache = cache
+        self.workers = workers or cpu_count() or 1
+        self.queue_size = queue_size
+        self.line_limit = line_limit
+        self.executor = None
+        self.queue = None
+        # golf course rows -> future of its result, while it waits or is being solved
+        self.in_flight = {}
+        self.solved = 0
+        self.coalesced = 0
+
+    async def submit(self, rows):
+        """
+        :param rows: rows of the golf course in CodinGame format
+        :return: future of the result of solve_rows, shared with the identical golf courses in flight (waits while
+                 the queue is full)
+        """
+        key = "\n".join(rows)
+        future = self.in_flight.get(key)
+        if future is not None:
+            self.coalesced += 1
+            return future
+        future = get_running_loop().create_future()
+        self.in_flight[key] = future
+        await self.queue.put((key, rows, future))
+        return future
+
+    async def dispatch(self):
+        """
+        Hand the queued golf courses to the pool one at a time (one dispatcher per worker)
+        """
+        loop = get_running_loop()
+        while True:
+            key, rows, future = await self.queue.get()
+            try:
+                future.set_result(await loop.run_in_executor(self.executor, solve_server_request, rows, self.mode))
+                self.solved += 1
+            except Exception as error:
+                future.set_exception(error)
+            finally:
+                del self.in_flight[key]
+
+    async def reply(self, writer, identifier, future):
+        """
+        :param writer: StreamWriter of the connection
+        :param identifier: identifier of the request
+        :param future: future of the result of solve_rows
+        """
+        try:
+            solution, error, _, _ = await future
+        except Exception as exception:
+            solution, error = None, "failed: {}".format(exception)
+        writer.write((result_json(identifier, solution, error) + "\n").encode())
+        try:
+            await writer.drain()
+        except ConnectionError:
+            pass
+
+    async def handle(self, reader, writer):
+        """
+        Serve a connection until the client closes it
+        :param reader: StreamReader of the connection
+        :param writer: StreamWriter of the connection
+        """
+        # replies not written yet (each one is dropped once written)
+        replies = set()
+        try:
+            while True:
+                line = await read_request_line(reader)
+                if line is None:
+                    writer.write((result_json(None, None, "bad request: line longer than {} bytes".format(
+                        self.line_limit)) + "\n").encode())
+                    continue
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+                try:
+                    puzzle = json_loads(line)
+                except ValueError as error:
+                    writer.write((result_json(None, None, "bad request: invalid JSON: {}".format(error)) +
+                                  "\n").encode())
+                    continue
+                if not isinstance(puzzle, dict):
+                    writer.write((result_json(None, None, "bad request: expected a JSON object") + "\n").encode())
+                    continue
+                identifier, rows = read_jsonl_golf_course(puzzle, "request:1")
+                error = golf_course_error(rows)
+                if error is not None:
+                    writer.write((result_json(identifier, None, "bad request: {}".format(error)) + "\n").encode())
+                    continue
+                future = await self.submit(rows)
+                reply = create_task(self.reply(writer, identifier, future))
+                replies.add(reply)
+                reply.add_done_callback(replies.discard)
+            await gather(*replies)
+        finally:
+            writer.close()
+
+    async def serve(self, host="127.0.0.1", port=SERVER_PORT, path=None, ready=None):
+        """
+        :param host: address to listen on (TCP)
+        :param port: port to listen on (TCP)
+        :param path: Unix socket to listen on instead of TCP (None for TCP)
+        :param ready: asyncio.Event set once the server listens (None if not needed)
+        """
+        self.queue = AsyncQueue(self.queue_size)
+        # spawned workers: forked ones would inherit the sockets of the connections open when they start (the cache is
+        # sent once to each of them)
+        self.executor = ProcessPoolExecutor(self.workers, mp_context=get_context("spawn"),
+                                            initializer=init_server_worker, initargs=(self.cache,))
+        with self.executor:
+            dispatchers = [create_task(self.dispatch()) for _ in range(self.workers)]
+            if path is None:
+                server = await start_server(self.handle, host, port, limit=self.line_limit)
             else:
-                set_balls_orders = set()
-                set_balls_orders.add(tuple(balls_distances))
-                find_another_order(directions_strategy, tuple(directions_strategy), set_directions_strategy)
-            return get_possible_paths(golf_course, balls_distances, directions_strategy, set_balls_orders,
-                                      set_directions_strategy)
+                server = await start_unix_server(self.handle, path, limit=self.line_limit)
+            if ready is not None:
+                ready.set()
+            try:
+                async with server:
+                    await server.serve_forever()
+            finally:
+                for dispatcher in dispatchers:
+                    dispatcher.cancel()
+
+
+def serve_main(argv=None):
+    """
+    Run a SolveServer until interrupted
+    :param argv: command line arguments (sys.argv[2:] if None)
+    """
+    parser = ArgumentParser(description="Serve Winamax golf courses solutions")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=SERVER_PORT)
+    parser.add_argument("--unix", help="Unix socket to listen on instead of TCP")
+    parser.add_argument("--mode", default="backtrack", choices=sorted(SOLVER_MODES))
+    parser.add_argument("--workers", type=int, default=0, help="worker processes (0 for one per core)")
+    parser.add_argument("--queue-size", type=int, default=SERVER_QUEUE_SIZE, help="golf courses waiting at most")
+    parser.add_argument("--cache", help="sqlite file of the solutions kept from run to run")
+    parser.add_argument("--line-limit", type=int, default=SERVER_LINE_LIMIT, help="longest request line in bytes")
+    args = parser.parse_args(sys.argv[2:] if argv is None else argv)
+    if args.workers < 0:
+        parser.error("--workers must be 0 (one per core) or more")
 
-    return golf_course_updated
+    cache = None if args.cache is None else SolutionCache(args.cache)
+    server = SolveServer(args.mode, args.workers, args.queue_size, cache, args.line_limit)
+    try:
+        asyncio_run(server.serve(args.host, args.port, args.unix))
+    except KeyboardInterrupt:
+        pass
+
+
+def speedup_main(argv=None):
+    """
+    Print the speed-up of the "parallel" mode (see report_parallel_speedup) on each golf course of the files
+    :param argv: command line arguments (sys.argv[2:] if None)
+    """
+    parser = ArgumentParser(description="Measure the speed-up of the parallel search on Winamax golf courses")
+    parser.add_argument("paths", nargs="*", default=["-"], help="files to solve (- for the standard input)")
+    parser.add_argument("--jsonl", action="store_true", help="the files are JSONL corpora")
+    parser.add_argument("--workers", type=int, nargs="+", help="numbers of workers to try (default: powers of 2)")
+    args = parser.parse_args(sys.argv[2:] if argv is None else argv)
+    if args.workers is not None and min(args.workers) < 1:
+        parser.error("--workers must be at least 1")
+
+    for identifier, rows in iter_golf_courses(args.paths, args.jsonl):
+        print(identifier)
+        report_parallel_speedup(rows, parse_golf_course(rows)[1], args.workers)
 
 
 #######################################################################
 #######################################################################
 #######################################################################
 
-def main():
+def main(mode="backtrack"):
     golf_course = [
         ['.', '.', '.', 'X', '.', '.', '.', '.', '.', '.', '.', '.', '.', '.', '.', '.', 'X', 'X', '.', '.', '.', '.',
          '.', 'H', '.', '.', '.', '.', '.', '.', '.', '.', '.', 'H', '.', '.', '.', '.', '.', '.', '.', '.', '.', '.',
@@ -268,11 +2723,6 @@ def main():
     balls_distances = [((2, 29), 4), ((2, 39), 4), ((2, 40), 4), ((3, 3), 5), ((3, 16), 5), ((3, 23), 5), ((3, 33), 5),
                        ((3, 46), 5), ((6, 6), 4), ((6, 13), 4), ((6, 26), 4), ((6, 36), 4), ((6, 43), 4), ((7, 0), 3),
                        ((7, 19), 3), ((7, 20), 3), ((7, 30), 3)]
-    set_balls_orders = set()
-    set_balls_orders.add(tuple(balls_distances))
-    directions_strategy = ["^", ">", "v", "<"]
-    set_directions_strategy = set()
-    set_directions_strategy.add(tuple(directions_strategy))
 
     ####### Calculate the number of possible paths #######
     nb_possibilities = 0
@@ -282,13 +2732,21 @@ def main():
     ######################################################
 
     # we get the final golf course
-    final_golf_course = get_possible_paths(golf_course, balls_distances, directions_strategy, set_balls_orders,
-                                           set_directions_strategy)
+    final_golf_course = solve_golf_course(GolfGrid(golf_course), balls_distances, mode)
 
     # replace "BinH" and "X" by "."
     print(finalize_golf_course(final_golf_course))
 
 
 if __name__ == "__main__":
-    cProfile_run('main()')
+    # "serve": solve server (see serve_main), "speedup": parallel speed-up report (see speedup_main), other arguments:
+    # batch of golf courses (see batch_main), else the profiled example
+    if sys.argv[1:2] == ["serve"]:
+        serve_main()
+    elif sys.argv[1:2] == ["speedup"]:
+        speedup_main()
+    elif len(sys.argv) > 1:
+        batch_main()
+    else:
+        cProfile_run('main()')
     # main()